@@ -1,19 +1,37 @@
+import functools
+import heapq
+import io
+import os
+import random
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from array import array
+from collections import namedtuple
+from collections.abc import Mapping
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    import scipy.sparse
+except ImportError:
+    scipy = None
+
+
 # First part
 def shape(m):
     return len(m), len(m[0])
 
 
-def print_map(m, pos):
-    n_rows, n_cols = shape(m)
-    for row in range(n_rows):
-        for col in range(n_cols):
-            if pos[0] == row and pos[1] == col:
-                print('@', end='')
-            elif m[row][col]:
-                print('.', end='')
-            else:
-                print('#', end='')
-        print()
+def print_map(m, pos, file=None):
+    canvas = map_canvas(m)
+    canvas[canvas_offset(m, pos)] = ord('@')
+    write_frame(file, canvas)
 
 
 def neighbours(m, pos):
@@ -52,15 +70,316 @@ def find_route_step(m, cur_pos, cur_path, visited):
     return []
 
 
-def find_route(m, initial):
-    return find_route_step(m, initial, [initial], {initial})
+WALL, OPEN, EXIT = 0, 1, 2
+OPEN_CELLS = bytes([WALL] + [OPEN] * 255)
+EXIT_CELLS = bytes([WALL] + [EXIT] * 255)
+
+
+def row_bytes(row):
+    # bytes() of any other buffer (NumPy rows, array.array) would copy its
+    # raw memory instead of one byte per cell
+    if isinstance(row, (bytes, bytearray)):
+        return row
+    if np is not None and isinstance(row, np.ndarray):
+        return (row != 0).tobytes()
+    if isinstance(row, list):
+        try:
+            return bytes(row)
+        except (TypeError, ValueError):
+            pass
+    return bytes(map(bool, row))
+
+
+def flatten(m):
+    n_rows, n_cols = shape(m)
+    if np is not None and isinstance(m, np.ndarray):
+        rows = [row_bytes(m)]
+    else:
+        rows = [row_bytes(row) for row in m]
+    grid = bytearray(b"".join(rows)).translate(OPEN_CELLS)
+
+    # open cells on the border are exits
+    grid[:n_cols] = grid[:n_cols].translate(EXIT_CELLS)
+    grid[-n_cols:] = grid[-n_cols:].translate(EXIT_CELLS)
+    grid[::n_cols] = grid[::n_cols].translate(EXIT_CELLS)
+    grid[n_cols - 1::n_cols] = grid[n_cols - 1::n_cols].translate(EXIT_CELLS)
+    return grid
+
+
+def moves(n_cols):
+    return [(1, 1), (2, n_cols), (3, -1), (4, -n_cols)]
+
+
+def on_border(m, pos):
+    n_rows, n_cols = shape(m)
+    return pos[0] in (0, n_rows - 1) or pos[1] in (0, n_cols - 1)
+
+
+VECTOR_FRONTIER = 1 << 8
+
+
+def find_route_bfs(m, initial):
+    n_rows, n_cols = shape(m)
+    grid = flatten(m)
+    start = initial[0] * n_cols + initial[1]
+    if on_border(m, initial):
+        return [initial]
+
+    # corridors keep the frontier at a cell or two, where a plain loop is
+    # fastest, open areas switch to one array pass per move and level;
+    # exits are never expanded, so neighbours of frontier cells are in range
+    steps = moves(n_cols)
+    came_from = bytearray(len(grid))
+    grid[start] = WALL
+    frontier = [start]
+    while len(frontier):
+        if np is not None and len(frontier) >= VECTOR_FRONTIER:
+            frontier, found = bfs_level_array(grid, came_from, frontier,
+                                              n_cols)
+            if found is not None:
+                return walk_back(came_from, found, start, n_cols)
+            if len(frontier) < VECTOR_FRONTIER:
+                frontier = frontier.tolist()
+            continue
+        next_frontier = []
+        for code, step in steps:
+            for idx in frontier:
+                neighbour = idx + step
+                cell = grid[neighbour]
+                if not cell:
+                    continue
+                came_from[neighbour] = code
+                if cell == EXIT:
+                    return walk_back(came_from, neighbour, start, n_cols)
+                grid[neighbour] = WALL
+                next_frontier.append(neighbour)
+        frontier = next_frontier
+    return []
+
+
+def bfs_level_array(grid, came_from, frontier, n_cols):
+    # same expansion order as the loop, views share its buffers
+    cells = np.frombuffer(grid, dtype=np.uint8)
+    codes = np.frombuffer(came_from, dtype=np.uint8)
+    frontier = np.asarray(frontier, dtype=np.intp)
+    reached = []
+    for code, step in moves(n_cols):
+        neighbours = frontier + step
+        found = cells[neighbours]
+        neighbours = neighbours[found.view(bool)]
+        codes[neighbours] = code
+        if found.max() == EXIT:
+            exit_idx = neighbours[cells[neighbours] == EXIT][0]
+            return reached, int(exit_idx)
+        cells[neighbours] = WALL
+        reached.append(neighbours)
+    return np.concatenate(reached), None
+
+
+def find_route_astar(m, initial):
+    n_rows, n_cols = shape(m)
+    grid = flatten(m)
+    start = initial[0] * n_cols + initial[1]
+    if on_border(m, initial):
+        return [initial]
+
+    def to_border(idx):
+        row, col = divmod(idx, n_cols)
+        return min(row, col, n_rows - 1 - row, n_cols - 1 - col)
+
+    came_from = bytearray(len(grid))
+    dist = {start: 0}
+    heap = [(to_border(start), to_border(start), start)]
+    while heap:
+        estimate, left, idx = heapq.heappop(heap)
+        passed = estimate - left
+        if passed > dist[idx]:
+            continue
+        if grid[idx] == EXIT:
+            return walk_back(came_from, idx, start, n_cols)
+        passed += 1
+        for code, step in moves(n_cols):
+            neighbour = idx + step
+            if grid[neighbour] and passed < dist.get(neighbour, passed + 1):
+                dist[neighbour] = passed
+                came_from[neighbour] = code
+                left = to_border(neighbour)
+                heapq.heappush(heap, (passed + left, left, neighbour))
+    return []
+
+
+def walk_back(came_from, idx, start, n_cols):
+    steps = dict(moves(n_cols))
+    path = [idx]
+    while idx != start:
+        idx -= steps[came_from[idx]]
+        path.append(idx)
+    return [divmod(idx, n_cols) for idx in reversed(path)]
+
+
+def find_route(m, initial, method="bfs"):
+    if method == "dfs":
+        return find_route_step(m, initial, [initial], {initial})
+    if method == "astar":
+        return find_route_astar(m, initial)
+    if method == "bfs":
+        return find_route_bfs(m, initial)
+    raise ValueError(f"Unknown method {method!r}")
+
+
+def serpentine_maze(size):
+    # one corridor winding through every other row, the worst case for a
+    # level by level search, it leaves the map at the end of the last row
+    m = [[0] * size for _ in range(size)]
+    rows = range(1, size - 1, 2)
+    for i, row in enumerate(rows):
+        m[row][1:size - 1] = [1] * (size - 2)
+        if row + 2 < size - 1:
+            m[row + 1][size - 2 if i % 2 == 0 else 1] = 1
+    m[rows[-1]][size - 1 if len(rows) % 2 else 0] = 1
+    return m
 
 
-def escape(m, initial):
-    way_out = find_route(m, initial)
+def route_benchmark(size=1001, seed=0):
+    rnd = random.Random(seed)
+    maps = {"open": [[int(rnd.random() >= 0.3) for _ in range(size)]
+                     for _ in range(size)],
+            "corridor": serpentine_maze(size)}
+    starts = {"open": (size // 2, size // 2), "corridor": (1, 1)}
+    maps["open"][size // 2][size // 2] = 1
+
+    timings = {}
+    for name, m in maps.items():
+        routes = []
+        for method in ["bfs", "astar"]:
+            started = time.perf_counter()
+            routes.append(find_route(m, starts[name], method))
+            timings[name, method] = time.perf_counter() - started
+        assert len(routes[0]) == len(routes[1])
+    return timings
+
+
+MAP_CHARS = bytes.maketrans(bytes([WALL, OPEN, EXIT]), b"#..")
+
+
+def map_canvas(m):
+    n_rows, n_cols = shape(m)
+    cells = flatten(m).translate(MAP_CHARS)
+    rows = [cells[i:i + n_cols] for i in range(0, len(cells), n_cols)]
+    return bytearray(b"\n".join(rows) + b"\n")
+
+
+def canvas_offset(m, pos):
+    return pos[0] * (shape(m)[1] + 1) + pos[1]
+
+
+def write_frame(file, frame):
+    file = file or sys.stdout
+    if isinstance(file, io.TextIOBase):
+        file.write(frame.decode())
+    else:
+        file.write(bytes(frame))
+
+
+def render_move(n_lines, old, new):
+    # the cursor rests n_lines below the top of the map between frames
+    def put(pos, ch):
+        up = n_lines - pos[0]
+        right = f"\x1b[{pos[1]}C" if pos[1] else ""
+        return f"\x1b[{up}A\r{right}{ch}\r\x1b[{up}B"
+    return (put(old, '.') + put(new, '@')).encode()
+
+
+def escape(m, initial, method="bfs", file=None, delta=False):
+    way_out = find_route(m, initial, method)
+    if not way_out:
+        return
+
+    canvas = map_canvas(m) + b"\n"
+    if delta:
+        canvas[canvas_offset(m, way_out[0])] = ord('@')
+        write_frame(file, canvas)
+        for old, new in zip(way_out, way_out[1:]):
+            write_frame(file, render_move(shape(m)[0] + 1, old, new))
+        return
+
     for pos in way_out:
-        print_map(m, pos)
-        print()
+        offset = canvas_offset(m, pos)
+        cell, canvas[offset] = canvas[offset], ord('@')
+        write_frame(file, canvas)
+        canvas[offset] = cell
+
+
+ExitField = namedtuple("ExitField", ["n_rows", "n_cols", "dist", "towards"])
+
+
+def exit_field(m):
+    n_rows, n_cols = shape(m)
+    grid = flatten(m)
+    dist = array("i", [-1]) * len(grid)
+    towards = bytearray(len(grid))
+
+    border = set(range(n_cols)) | set(range(len(grid) - n_cols, len(grid))) | \
+        set(range(0, len(grid), n_cols)) | \
+        set(range(n_cols - 1, len(grid), n_cols))
+    frontier = sorted(idx for idx in border if grid[idx] == EXIT)
+    for idx in frontier:
+        dist[idx] = 0
+        grid[idx] = WALL
+
+    # neighbours of exits may lie outside the grid, so expand them with
+    # bounds checks; every later cell is an inner one
+    codes = {step: code for code, step in moves(n_cols)}
+    level = 0
+    next_frontier = []
+    for idx in frontier:
+        for row, col in neighbours(m, divmod(idx, n_cols)):
+            neighbour = row * n_cols + col
+            if grid[neighbour]:
+                towards[neighbour] = codes[neighbour - idx]
+                grid[neighbour] = WALL
+                next_frontier.append(neighbour)
+
+    frontier = next_frontier
+    while frontier:
+        level += 1
+        next_frontier = []
+        for idx in frontier:
+            dist[idx] = level
+        for code, step in moves(n_cols):
+            for idx in frontier:
+                neighbour = idx + step
+                if not grid[neighbour]:
+                    continue
+                towards[neighbour] = code
+                grid[neighbour] = WALL
+                next_frontier.append(neighbour)
+        frontier = next_frontier
+    return ExitField(n_rows, n_cols, dist, towards)
+
+
+def field_route(field, initial):
+    idx = initial[0] * field.n_cols + initial[1]
+    if field.dist[idx] < 0:
+        return []
+
+    steps = dict(moves(field.n_cols))
+    path = [idx]
+    for _ in range(field.dist[idx]):
+        idx -= steps[field.towards[idx]]
+        path.append(idx)
+    return [divmod(idx, field.n_cols) for idx in path]
+
+
+def field_routes(field, starts):
+    return [field_route(field, tuple(initial)) for initial in starts]
+
+
+def field_distances(field, starts):
+    if np is not None and isinstance(starts, np.ndarray):
+        dist = np.frombuffer(field.dist, dtype=np.int32)
+        return dist[starts[:, 0] * field.n_cols + starts[:, 1]]
+    return [field.dist[row * field.n_cols + col] for row, col in starts]
 
 # Second part
 
@@ -73,8 +392,256 @@ def hamming(seq1, seq2):
     return res
 
 
-def hba1(path, distance):
+def encode_lines(lines):
+    if len(set(map(len, lines))) > 1:
+        raise ValueError("sequences must have equal length")
+    joined = "".join(lines)
+    symbols = sorted(set(joined))
+    table = str.maketrans(dict(zip(symbols, map(chr, range(len(symbols))))))
+    codes = np.frombuffer(joined.translate(table).encode("latin-1"),
+                          dtype=np.uint8)
+    return codes.reshape(len(lines), len(lines[0])), len(symbols)
+
+
+# encoded rows are compared tile by tile, offsets hold the row sums of
+# sparse l1 profiles
+PairIndex = namedtuple("PairIndex", ["encoded", "metric", "offsets"])
+TILE_BYTES = 1 << 24
+TILE_ENTRIES = 1 << 20
+
+
+def hamming_index(lines):
+    codes, _ = encode_lines(lines)
+    return PairIndex(codes, "hamming", None)
+
+
+def sparse_min_sums(first, second):
+    # sum of min(a, b) over shared columns for every row pair, joining the
+    # nonzeros of first against the columns of second
+    first, second = first.tocoo(), second.tocsc()
+    starts = second.indptr[first.col]
+    lengths = second.indptr[first.col + 1] - starts
+    owners = np.repeat(np.arange(first.nnz), lengths)
+    offsets = np.cumsum(lengths) - lengths
+    matches = np.arange(lengths.sum()) - offsets[owners] + starts[owners]
+    cells = first.row[owners] * second.shape[0] + second.indices[matches]
+    mins = np.minimum(first.data[owners], second.data[matches])
+    sums = np.bincount(cells, weights=mins,
+                       minlength=first.shape[0] * second.shape[0])
+    return sums.reshape(first.shape[0], second.shape[0])
+
+
+def pair_distances(index, rows, cols):
+    encoded = index.encoded
+    if scipy is not None and scipy.sparse.issparse(encoded):
+        # |a - b| summed is sum(a) + sum(b) - 2 * sum(min(a, b)), the rows
+        # are split so that each join stays around TILE_ENTRIES matches
+        others = encoded[cols].tocsc()
+        col_sizes = np.diff(others.indptr)
+        firsts = encoded[rows]
+        joined = int(col_sizes[firsts.indices].sum())
+        step = max(1, TILE_ENTRIES * firsts.shape[0] // max(1, joined))
+        shared = np.vstack([sparse_min_sums(firsts[start:start + step],
+                                            others)
+                            for start in range(0, firsts.shape[0], step)])
+        return index.offsets[rows, None] + index.offsets[None, cols] - \
+            2 * shared.astype(np.int64)
+
+    # bound the rows x cols x width temporaries to TILE_BYTES at a time
+    others = encoded[cols]
+    step = max(1, TILE_BYTES // max(1, others.size * others.itemsize))
+    res = np.empty((rows.stop - rows.start, len(others)), dtype=np.int64)
+    for start in range(rows.start, rows.stop, step):
+        chunk = encoded[start:min(start + step, rows.stop)]
+        if index.metric == "hamming":
+            dist = (chunk[:, None] != others[None]).sum(axis=-1)
+        else:
+            dist = np.abs(chunk[:, None] - others[None]).sum(axis=-1)
+        res[start - rows.start:start - rows.start + len(chunk)] = dist
+    return res
+
+
+def block_min(index, start, block_size):
+    n_rows = index.encoded.shape[0]
+    rows = slice(start, min(start + block_size, n_rows))
+    best = None
+    for col_start in range(start, n_rows, block_size):
+        cols = slice(col_start, min(col_start + block_size, n_rows))
+        dist = pair_distances(index, rows, cols).astype(np.float64)
+        if col_start == start:
+            dist[np.tril_indices_from(dist)] = np.inf
+        i, j = divmod(int(np.argmin(dist)), dist.shape[1])
+        candidate = (dist[i, j], start + i, col_start + j)
+        if best is None or candidate < best:
+            best = candidate
+    return best
+
+
+def share_index(index):
+    # dense encodings go to shared memory instead of being pickled into
+    # every worker
+    if not isinstance(index.encoded, np.ndarray):
+        return None, index
+    memory = shared_memory.SharedMemory(create=True,
+                                        size=max(1, index.encoded.nbytes))
+    shared = np.ndarray(index.encoded.shape, index.encoded.dtype,
+                        buffer=memory.buf)
+    shared[...] = index.encoded
+    spec = (memory.name, index.encoded.shape, index.encoded.dtype.str)
+    return memory, index._replace(encoded=spec)
+
+
+def init_pair_worker(index):
+    global worker_index, worker_memory
+    if isinstance(index.encoded, tuple):
+        name, shape, dtype = index.encoded
+        worker_memory = shared_memory.SharedMemory(name=name)
+        index = index._replace(encoded=np.ndarray(shape, dtype,
+                                                  buffer=worker_memory.buf))
+    worker_index = index
+
+
+def worker_block_min(start, block_size):
+    return block_min(worker_index, start, block_size)
+
+
+def closest_pair(index, block_size=1024, processes=None):
+    if index.encoded.shape[0] < 2:
+        raise ValueError("closest pair needs at least two sequences")
+    starts = range(0, index.encoded.shape[0], block_size)
+    if processes is None:
+        blocks = [block_min(index, start, block_size) for start in starts]
+    else:
+        memory, shared = share_index(index)
+        try:
+            with ProcessPoolExecutor(processes, initializer=init_pair_worker,
+                                     initargs=(shared,)) as pool:
+                blocks = list(pool.map(worker_block_min, starts,
+                                       [block_size] * len(starts)))
+        finally:
+            if memory is not None:
+                memory.close()
+                memory.unlink()
+    _, i, j = min(blocks)
+    return i, j
+
+
+def shingle_hashes(lines, shingle):
+    # lines shorter than a shingle are hashed as a whole
+    data = np.frombuffer("".join(lines).encode("latin-1", "replace"),
+                         dtype=np.uint8).astype(np.uint64)
+    lengths = np.array([len(line) for line in lines], dtype=np.int64)
+    ends = np.cumsum(lengths)
+    counts = np.maximum(lengths - shingle + 1, 1)
+    firsts = np.cumsum(counts) - counts
+    owners = np.repeat(np.arange(len(lines)), counts)
+    positions = np.arange(counts.sum()) - firsts[owners] + \
+        (ends - lengths)[owners]
+
+    hashes = np.zeros(len(positions), dtype=np.uint64)
+    padded = np.append(data, np.zeros(shingle, dtype=np.uint64))
+    for t in range(shingle):
+        inside = positions + t < ends[owners]
+        hashes = hashes * np.uint64(257) + \
+            np.where(inside, padded[positions + t] + np.uint64(1), 0)
+    return (hashes >> np.uint64(32)) ^ (hashes & np.uint64(0xFFFFFFFF)), firsts
+
+
+def minhash_signatures(lines, n_hashes, shingle=8, seed=0, chunk_size=10000):
+    # multiply-shift hashing of 32-bit shingle hashes, wrapping mod 2^64
+    rng = np.random.default_rng(seed)
+    a = rng.integers(1, 1 << 63, n_hashes, dtype=np.uint64) | np.uint64(1)
+    b = rng.integers(0, 1 << 63, n_hashes, dtype=np.uint64)
+    signatures = np.empty((len(lines), n_hashes), dtype=np.uint64)
+    for start in range(0, len(lines), chunk_size):
+        chunk = lines[start:start + chunk_size]
+        hashes, firsts = shingle_hashes(chunk, shingle)
+        for h in range(n_hashes):
+            mixed = (a[h] * hashes + b[h]) >> np.uint64(32)
+            signatures[start:start + len(chunk), h] = \
+                np.minimum.reduceat(mixed, firsts)
+    return signatures
+
+
+def adjacent_pairs(signatures, members):
+    # neighbours in signature order, identical lines always end up adjacent
+    order = members[np.lexsort(signatures[members].T[::-1])].tolist()
+    return {(min(x, y), max(x, y)) for x, y in zip(order, order[1:])}
+
+
+def lsh_candidates(lines, bands=16, rows=4, shingle=8, seed=0,
+                   max_bucket=64):
+    # buckets above max_bucket only pair up neighbours in signature order,
+    # which keeps exact and near duplicates without comparing all pairs
+    signatures = minhash_signatures(lines, bands * rows, shingle, seed)
+    weights = np.random.default_rng(seed).integers(
+        1, 1 << 63, rows, dtype=np.uint64)
+    candidates = set()
+    for band in range(bands):
+        band_rows = signatures[:, band * rows:(band + 1) * rows]
+        keys = (band_rows * weights).sum(axis=1)
+        order = np.argsort(keys, kind="stable")
+        bounds = np.flatnonzero(np.diff(keys[order])) + 1
+        for bucket in np.split(order, bounds):
+            if len(bucket) > max_bucket:
+                candidates |= adjacent_pairs(signatures, bucket)
+            elif len(bucket) > 1:
+                bucket = sorted(bucket.tolist())
+                for x in range(len(bucket)):
+                    for y in range(x + 1, len(bucket)):
+                        candidates.add((bucket[x], bucket[y]))
+    if not candidates and len(lines) > 1:
+        # no bucket collided at all, fall back to signature neighbours
+        candidates = adjacent_pairs(signatures, np.arange(len(lines)))
+    return candidates
+
+
+def closest_pair_lsh(lines, distance, bands=16, rows=4, shingle=8, seed=0,
+                     max_bucket=64):
+    if np is None:
+        raise RuntimeError("approximate search needs numpy")
+    if len(lines) < 2:
+        raise ValueError("closest pair needs at least two sequences")
+    candidates = lsh_candidates(lines, bands, rows, shingle, seed,
+                                max_bucket)
+    best = min((distance(lines[i], lines[j]), i, j) for i, j in candidates)
+    return best[1:]
+
+
+def lsh_recall(lines, distance, bands=16, rows=4, shingle=8, seed=0,
+               max_bucket=64, sample_size=500):
+    sample = random.Random(seed).sample(lines, min(sample_size, len(lines)))
+    candidates = lsh_candidates(sample, bands, rows, shingle, seed,
+                                max_bucket)
+    hits = 0
+    for i in range(len(sample)):
+        others = [(distance(sample[i], sample[j]), j)
+                  for j in range(len(sample)) if j != i]
+        nearest = min(others)[0]
+        hits += any(dist == nearest and (min(i, j), max(i, j)) in candidates
+                    for dist, j in others)
+    return hits / len(sample)
+
+
+def hba1(path, distance, block_size=1024, processes=None, k=2,
+         bands=None, rows=4, shingle=8, seed=0, max_bucket=64):
     lines = open(path, 'r').read().splitlines()
+    if bands is not None:
+        if distance is distance1:
+            distance = functools.partial(distance1, k=k)
+        return closest_pair_lsh(lines, distance, bands, rows, shingle, seed,
+                                max_bucket)
+
+    # unequal lengths keep the pairwise loop and its prefix semantics
+    if distance is hamming and np is not None and \
+            len(set(map(len, lines))) == 1:
+        return closest_pair(hamming_index(lines), block_size, processes)
+    if distance is distance1 and np is not None:
+        index = kmer_index(kmer_profiles(lines, k))
+        return closest_pair(index, block_size, processes)
+    if distance is distance1:
+        distance = functools.partial(distance1, k=k)
+
     distances = {}
     for i in range(len(lines)):
         for j in range(i + 1, len(lines)):
@@ -92,13 +659,292 @@ def kmers(seq, k=2):
     return d
 
 
-def distance1(seq1, seq2):
+def distance1(seq1, seq2, k=2):
     dist = 0
-    d1 = kmers(seq1)
-    d2 = kmers(seq2)
+    d1 = seq1 if isinstance(seq1, Mapping) else kmers(seq1, k)
+    d2 = seq2 if isinstance(seq2, Mapping) else kmers(seq2, k)
     keys = d1.keys() | d2.keys()
     for key in keys:
         dist += abs(d1.get(key, 0) - d2.get(key, 0))
     return dist
 
-assert shape([[0]]) == (1, 1), "ERROR"
\ No newline at end of file
+
+DENSE_PROFILE_LIMIT = 4096
+
+
+def kmer_profiles(lines, k=2):
+    vocabulary = {}
+    rows, cols, counts = [], [], []
+    for i, line in enumerate(lines):
+        for kmer, count in kmers(line, k).items():
+            rows.append(i)
+            cols.append(vocabulary.setdefault(kmer, len(vocabulary)))
+            counts.append(count)
+
+    shape = len(lines), len(vocabulary)
+    if scipy is not None and len(vocabulary) > DENSE_PROFILE_LIMIT:
+        return scipy.sparse.csr_matrix((counts, (rows, cols)), shape=shape)
+    profiles = np.zeros(shape, dtype=np.int64)
+    profiles[rows, cols] = counts
+    return profiles
+
+
+def kmer_index(profiles):
+    if scipy is not None and scipy.sparse.issparse(profiles):
+        profiles = profiles.astype(np.int32)
+        offsets = np.asarray(profiles.sum(axis=1), dtype=np.int64).ravel()
+        return PairIndex(profiles.tocsr(), "l1", offsets)
+    return PairIndex(profiles.astype(np.int32), "l1", None)
+
+
+def kmer_distances(index, pairs):
+    firsts, seconds = np.asarray(pairs).T
+    dist = abs(index.encoded[firsts] - index.encoded[seconds]).sum(axis=1)
+    return np.asarray(dist, dtype=np.int64).ravel()
+
+NUCLEOTIDES = "ACGT"
+DIRECT_TABLE_LIMIT = 1 << 24
+
+
+class DirectTable:
+    def __init__(self, k):
+        self.counts = np.zeros(4 ** k, dtype=np.int64)
+
+    def add(self, values, counts):
+        self.counts[values] += counts
+
+    def count(self, value):
+        return int(self.counts[value])
+
+    def items(self):
+        values = np.flatnonzero(self.counts)
+        return values, self.counts[values]
+
+
+class HashTable:
+    EMPTY = np.uint64(2 ** 64 - 1)
+
+    def __init__(self, bits=16):
+        self.bits = bits
+        self.keys = np.full(1 << bits, self.EMPTY, dtype=np.uint64)
+        self.counts = np.zeros(1 << bits, dtype=np.int64)
+        self.size = 0
+
+    def slots(self, values):
+        mixed = values * np.uint64(0x9E3779B97F4A7C15)
+        return (mixed >> np.uint64(64 - self.bits)).astype(np.int64)
+
+    def add(self, values, counts):
+        # values must be unique within one call
+        if 2 * (self.size + len(values)) > len(self.keys):
+            bits = self.bits
+            while 2 * (self.size + len(values)) > 1 << bits:
+                bits += 1
+            old_values, old_counts = self.items()
+            self.__init__(bits)
+            self.add(old_values, old_counts)
+
+        mask = len(self.keys) - 1
+        slots = self.slots(values)
+        while len(values):
+            stored = self.keys[slots]
+            done = stored == values
+            self.counts[slots[done]] += counts[done]
+
+            # several values may race for one empty slot, the first one wins
+            claims = np.flatnonzero(stored == self.EMPTY)
+            _, firsts = np.unique(slots[claims], return_index=True)
+            won = claims[firsts]
+            self.keys[slots[won]] = values[won]
+            self.counts[slots[won]] = counts[won]
+            self.size += len(won)
+            done[won] = True
+
+            probe = ~done
+            probe[claims] = False
+            slots[probe] = (slots[probe] + 1) & mask
+            left = ~done
+            values, counts, slots = values[left], counts[left], slots[left]
+
+    def count(self, value):
+        value = np.uint64(value)
+        slot = int(self.slots(np.array([value]))[0])
+        while self.keys[slot] != self.EMPTY:
+            if self.keys[slot] == value:
+                return int(self.counts[slot])
+            slot = (slot + 1) & (len(self.keys) - 1)
+        return 0
+
+    def items(self):
+        used = self.keys != self.EMPTY
+        return self.keys[used], self.counts[used]
+
+
+class KmerCounts(Mapping):
+    def __init__(self, k, table):
+        self.k = k
+        self.table = table
+
+    def __getitem__(self, kmer):
+        if len(kmer) != self.k or set(kmer) - set(NUCLEOTIDES):
+            raise KeyError(kmer)
+        value = 0
+        for ch in kmer:
+            value = value << 2 | NUCLEOTIDES.index(ch)
+        count = self.table.count(value)
+        if not count:
+            raise KeyError(kmer)
+        return count
+
+    def __iter__(self):
+        values, _ = self.table.items()
+        for value in values.tolist():
+            kmer = []
+            for _ in range(self.k):
+                kmer.append(NUCLEOTIDES[value & 3])
+                value >>= 2
+            yield "".join(reversed(kmer))
+
+    def __len__(self):
+        return len(self.table.items()[0])
+
+
+def count_codes(table, codes, k):
+    n = len(codes) - k + 1
+    if n <= 0:
+        return
+    invalid = np.concatenate(([0], np.cumsum(codes > 3)))
+    values = np.zeros(n, dtype=np.uint64)
+    for t in range(k):
+        values = values << np.uint64(2) | (codes[t:t + n] & 3)
+    values = values[invalid[k:] == invalid[:n]]
+    # both tables take unique values, so a chunk costs its own length
+    table.add(*np.unique(values, return_counts=True))
+
+
+def count_kmers(source, k=2, chunk_size=1 << 20):
+    # FASTA headers split records, anything but ACGT breaks a k-mer
+    if np is None:
+        raise RuntimeError("streaming k-mer counting needs numpy")
+    # 2 bits per base, and the all-T 32-mer would be HashTable.EMPTY
+    if not 1 <= k <= 31:
+        raise ValueError("k must be between 1 and 31")
+    if isinstance(source, str):
+        with open(source, "rb") as handle:
+            return count_kmers(handle, k, chunk_size)
+
+    handle = source
+    codes = np.full(256, 4, dtype=np.uint8)
+    for code, ch in enumerate(NUCLEOTIDES):
+        codes[ord(ch)] = codes[ord(ch.lower())] = code
+    table = DirectTable(k) if 4 ** k <= DIRECT_TABLE_LIMIT else HashTable()
+
+    # the last k - 1 bases roll over into the next chunk
+    tail = np.zeros(0, dtype=np.uint8)
+    while True:
+        lines = handle.readlines(chunk_size)
+        if not lines:
+            break
+        segment = [tail]
+        for line in lines:
+            if isinstance(line, str):
+                line = line.encode("latin-1", "replace")
+            if line.startswith(b">"):
+                count_codes(table, np.concatenate(segment), k)
+                segment = []
+            else:
+                segment.append(codes[np.frombuffer(line.strip(),
+                                                   dtype=np.uint8)])
+        segment = np.concatenate(segment or [tail[:0]])
+        count_codes(table, segment, k)
+        tail = segment[max(0, len(segment) - k + 1):]
+    return KmerCounts(k, table)
+
+
+assert shape([[0]]) == (1, 1), "ERROR"
+
+test_maze = [[0, 0, 0, 0, 0],
+             [0, 1, 1, 1, 0],
+             [0, 1, 0, 1, 1],
+             [0, 1, 1, 1, 0],
+             [0, 1, 0, 0, 0]]
+assert find_route(test_maze, (1, 1)) == [(1, 1), (2, 1), (3, 1), (4, 1)], \
+    "ERROR"
+assert find_route(test_maze, (1, 3)) == [(1, 3), (2, 3), (2, 4)], "ERROR"
+assert find_route(test_maze, (4, 1)) == [(4, 1)], "ERROR"
+assert find_route([[0, 0, 0], [0, 1, 0], [0, 0, 0]], (1, 1)) == [], "ERROR"
+assert find_route(test_maze, (1, 1), "bfs") == \
+    find_route(test_maze, (1, 1)), "ERROR"
+assert find_route([[0, 0, 0], [0, 1, 1], [0, 0, 0]], (1, 1), "bfs") == \
+    [(1, 1), (1, 2)], "ERROR"
+if np is not None:
+    assert find_route(np.array([[0, 0, 0], [0, 1, 1], [0, 0, 0]]),
+                      (1, 1), "bfs") == [(1, 1), (1, 2)], "ERROR"
+try:
+    find_route(test_maze, (1, 1), "dijkstra")
+    assert False, "ERROR"
+except ValueError:
+    pass
+assert len(find_route(serpentine_maze(7), (1, 1))) == 18, "ERROR"
+assert len(route_benchmark(51)) == 4, "ERROR"
+
+test_field = exit_field(test_maze)
+assert field_distances(test_field, [(1, 1), (1, 3), (4, 1), (0, 0)]) == \
+    [3, 2, 0, -1], "ERROR"
+assert field_routes(test_field, [(1, 3), (0, 0)]) == \
+    [[(1, 3), (2, 3), (2, 4)], []], "ERROR"
+
+test_handle = io.StringIO()
+escape(test_maze, (1, 3), file=test_handle)
+assert test_handle.getvalue().split("\n\n")[2] == \
+    "#####\n#...#\n#.#.@\n#...#\n#.###", "ERROR"
+test_handle = io.BytesIO()
+escape(test_maze, (1, 3), file=test_handle, delta=True)
+assert test_handle.getvalue().count(b"@") == 3, "ERROR"
+
+if np is not None:
+    test_rnd = random.Random(0)
+    test_reads = ["".join(test_rnd.choice("ACGT") for _ in range(100))
+                  for _ in range(300)]
+    test_reads += [test_reads[-1]] * 100
+    with tempfile.TemporaryDirectory() as test_dir:
+        test_path = os.path.join(test_dir, "reads.txt")
+        with open(test_path, "w") as test_file:
+            test_file.write("\n".join(test_reads))
+        assert hba1(test_path, hamming) == (299, 300), "ERROR"
+        assert hba1(test_path, hamming, bands=16) == (299, 300), "ERROR"
+
+        with open(test_path, "w") as test_file:
+            test_file.write("\n".join(test_reads[:300]))
+        test_i, test_j = hba1(test_path, hamming, bands=4, rows=8)
+        assert 0 <= test_i < test_j < 300, "ERROR"
+
+        with open(test_path, "w") as test_file:
+            test_file.write(test_reads[0])
+        for test_distance in [hamming, distance1]:
+            try:
+                hba1(test_path, test_distance)
+                assert False, "ERROR"
+            except ValueError:
+                pass
+
+    test_fasta = b">r1\nACGTTTNACG\nTTAC\n>r2\nacgtac\n" \
+        b">r3\nACGTACGTTGCAACGTAGG\nCTAGCATCG\n"
+    for test_k in [2, 13, 3]:
+        test_counts = count_kmers(io.BytesIO(test_fasta), test_k,
+                                  chunk_size=8)
+        test_expected = {}
+        for test_seq in ["ACGTTT", "ACGTTAC", "ACGTAC",
+                         "ACGTACGTTGCAACGTAGGCTAGCATCG"]:
+            for test_kmer, test_n in kmers(test_seq, test_k).items():
+                test_expected[test_kmer] = \
+                    test_expected.get(test_kmer, 0) + test_n
+        assert dict(test_counts) == test_expected, "ERROR"
+    assert isinstance(count_kmers(io.BytesIO(test_fasta), 13).table,
+                      HashTable), "ERROR"
+
+if __name__ == "__main__":
+    # the winding corridor is the slowest map for the default search
+    test_timings = route_benchmark()
+    assert test_timings["open", "bfs"] < 1, "ERROR"
+    assert test_timings["corridor", "bfs"] < 2, "ERROR"
@@ -1,6 +1,75 @@
+import builtins
+import functools
+import os
+import re
+import time
+from collections import deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from itertools import count, islice
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
 # First part
+class Pipeline:
+    # stages run first to last; nested pipelines are spliced in flat
+    def __init__(self, *stages):
+        flat = []
+        for stage in stages:
+            if isinstance(stage, Pipeline):
+                flat.extend(stage.stages)
+            else:
+                flat.append(stage)
+        self.stages = tuple(flat)
+        if not self.stages:
+            raise ValueError("Pipeline needs at least one stage")
+        self.head, self.tail = self.stages[0], self.stages[1:]
+
+    def __call__(self, *args, **kwargs):
+        res = self.head(*args, **kwargs)
+        for stage in self.tail:
+            res = stage(res)
+        return res
+
+    def __repr__(self):
+        return f"Pipeline{self.stages}"
+
+    def apply_batch(self, batch):
+        # stage by stage over the whole batch, so the loop runs inside map
+        for stage in self.stages:
+            batch = list(map(stage, batch))
+        return batch
+
+    def batches(self, iterable, batch_size):
+        it = iter(iterable)
+        batch = list(islice(it, batch_size))
+        while batch:
+            yield batch
+            batch = list(islice(it, batch_size))
+
+    def map_many(self, iterable, batch_size=1024):
+        for batch in self.batches(iterable, batch_size):
+            yield from self.apply_batch(batch)
+
+    def pmap(self, iterable, batch_size=1024, processes=None, window=None):
+        # stages have to be picklable, e.g. module-level functions; at most
+        # window batches are in flight, so the input is read as we go
+        window = window or 2 * (processes or os.cpu_count())
+        with ProcessPoolExecutor(processes) as pool:
+            pending = deque()
+            for batch in self.batches(iterable, batch_size):
+                pending.append(pool.submit(self.apply_batch, batch))
+                if len(pending) >= window:
+                    yield from pending.popleft().result()
+            while pending:
+                yield from pending.popleft().result()
+
+
 def compose(f, g):
-    return lambda *args, **kwargs: f(g(*args, **kwargs))
+    return Pipeline(g, f)
 
 
 def constantly(ret_val):
@@ -12,112 +81,354 @@ def flip(func):
 
 
 def curry(func, *args_1):
-    return lambda *args_2, **kwargs: func(*(args_1 + args_2), **kwargs)
+    # nested partials are merged into one
+    return functools.partial(func, *args_1)
 
 
 # Second part
 def enumerate(xs, start=0):
-    nums = range(start, start + len(xs))
-    return zip(nums, xs)
+    return zip(count(start), xs)
+
+
+def vectorized(predicate, xs):
+    # boolean mask for 1-d arrays when the predicate works on whole arrays
+    if np is None or not isinstance(xs, np.ndarray) or xs.ndim != 1:
+        return None
+    try:
+        mask = predicate(xs)
+    except Exception:
+        return None
+    if isinstance(mask, np.ndarray) and mask.dtype == bool and \
+            mask.shape == xs.shape:
+        return mask
+    return None
 
 
 def which(predicate, xs):
-    return [i for i in range(len(xs)) if predicate(xs[i])]
+    mask = vectorized(predicate, xs)
+    if mask is not None:
+        return np.flatnonzero(mask)
+    return [i for i, x in enumerate(xs) if predicate(x)]
 
 
 def all(predicate, xs):
-    return len(xs) == len(list(filter(predicate, xs)))
+    mask = vectorized(predicate, xs)
+    if mask is not None:
+        return bool(mask.all())
+    return builtins.all(map(predicate, xs))
 
 
 def any(predicate, xs):
-    return len(list(filter(predicate, xs))) > 0
+    mask = vectorized(predicate, xs)
+    if mask is not None:
+        return bool(mask.any())
+    return builtins.any(map(predicate, xs))
 
 
 # Third part
 OK, ERROR = "OK", "ERROR"
 
+# parsers take the parse state and an offset into its text and return
+# (tag, result or error message, offset after the parsed span)
+State = namedtuple("State", ["text", "memo", "partial"])
+
+
+def run(parser, state, pos):
+    if state.memo is None:
+        return parser(state, pos)
+    key = parser, pos
+    if key not in state.memo:
+        state.memo[key] = parser(state, pos)
+    return state.memo[key]
+
+
+class NeedMoreInput(Exception):
+    pass
+
+
+def eof(state, pos):
+    # a streamed parse that looks past its buffer is retried with more input
+    if state.partial:
+        raise NeedMoreInput()
+    return ERROR, "eof", pos
+
 
 def char(ch):
-    def inner(input):
-        if not input:
-            return ERROR, "eof", input
-        elif input[0] != ch:
-            return ERROR, "expected " + ch + " got " + input[0], input
+    def inner(state, pos):
+        if pos >= len(state.text):
+            return eof(state, pos)
+        elif state.text[pos] != ch:
+            return ERROR, "expected " + ch + " got " + state.text[pos], pos
         else:
-            return OK, ch, input[1:]
+            return OK, ch, pos + 1
+    inner.node = "char", ch
     return inner
 
 
 def any_of(s):
-    def inner(input):
-        if not input:
-            return ERROR, "eof", input
-        elif input[0] not in s:
-            return ERROR, "expected any of " + s + " got " + input[0], input
+    chars = frozenset(s)
+
+    def inner(state, pos):
+        if pos >= len(state.text):
+            return eof(state, pos)
+        elif state.text[pos] not in chars:
+            return ERROR, "expected any of " + s + " got " + state.text[pos], \
+                pos
         else:
-            return OK, input[0], input[1:]
+            return OK, state.text[pos], pos + 1
+    inner.node = "any_of", s
     return inner
 
 
 def chain(*args):
-    def inner(input):
+    def inner(state, pos):
         parsed = []
-        cur_input = input
+        cur_pos = pos
         for arg in args:
-            tag, res, leftover = arg(cur_input)
+            tag, res, leftover = run(arg, state, cur_pos)
             if tag == OK:
                 parsed += res
-                cur_input = leftover
+                cur_pos = leftover
             else:
-                return ERROR, res, input
-        return OK, parsed, cur_input
+                return ERROR, res, pos
+        return OK, parsed, cur_pos
+    inner.node = ("chain",) + args
     return inner
 
 
 def choice(*args):
-    def inner(input):
+    def inner(state, pos):
         for arg in args:
-            res = arg(input)
+            res = run(arg, state, pos)
             if res[0] == OK:
                 return res
-        return ERROR, "none matched", input
+        return ERROR, "none matched", pos
+    inner.node = ("choice",) + args
     return inner
 
 
 def many(parser, empty=True):
-    def inner(input):
+    def inner(state, pos):
         parsed = []
-        leftover = input
+        leftover = pos
         while True:
-            tag, res, leftover = parser(leftover)
+            tag, res, leftover = run(parser, state, leftover)
             if tag == OK:
                 parsed.append(res)
             elif not parsed and not empty:
-                return ERROR, res, input
+                return ERROR, res, pos
             else:
                 return OK, parsed, leftover
+    inner.node = "many", parser, empty
     return inner
 
 
 def skip(parser):
-    def inner(input):
-        tag, res, leftover = parser(input)
+    def inner(state, pos):
+        tag, res, leftover = run(parser, state, pos)
         return tag, None if tag == OK else res, leftover
+    inner.node = "skip", parser
     return inner
 
 
 def transform(p, f):
-    def inner(input):
-        tag, res, leftover = p(input)
+    def inner(state, pos):
+        tag, res, leftover = run(p, state, pos)
         return tag, f(res) if tag == OK else res, leftover
+    inner.node = "transform", p, f
     return inner
 
 
 def sep_by(p, sep):
-    return chain(p, many(transform(chain(sep, p), lambda xs: xs[1])))
+    rest = transform(chain(sep, p), lambda xs: xs[1])
+    parser = chain(p, many(rest))
+
+    def inner(state, pos):
+        return parser(state, pos)
+    inner.node = "sep_by", p, sep, rest
+    return inner
 
 
-def parse(parser, input):
-    tag, res, leftover = parser(input)
-    assert tag == OK and not leftover, (res, leftover)
+def parse(parser, input, memo=False):
+    state = State(input, {} if memo else None, False)
+    tag, res, leftover = run(parser, state, 0)
+    assert tag == OK and leftover == len(input), (res, input[leftover:])
     return res
+
+
+# Streaming
+class Stream:
+    def __init__(self, source, chunk_size):
+        self.chunks = iter(source) if not hasattr(source, "read") else \
+            iter(lambda: source.read(chunk_size), source.read(0))
+        self.text = ""
+        self.pos = 0
+        self.exhausted = False
+
+    def refill(self):
+        # read at least as much as is buffered, so retries of a long element
+        # cost O(n) in total
+        parts = [self.text[self.pos:]]
+        size = 0
+        while size <= len(parts[0]):
+            chunk = next(self.chunks, None)
+            if chunk is None:
+                self.exhausted = True
+                break
+            parts.append(chunk)
+            size += len(chunk)
+        self.text = "".join(parts)
+        self.pos = 0
+
+    def step(self, parser):
+        while True:
+            state = State(self.text, None, not self.exhausted)
+            try:
+                tag, res, leftover = parser(state, self.pos)
+            except NeedMoreInput:
+                self.refill()
+                continue
+            if tag == OK:
+                self.pos = leftover
+            return tag, res
+
+    def expect(self, parser):
+        tag, res = self.step(parser)
+        assert tag == OK, (res, self.rest())
+        return res
+
+    def rest(self):
+        while not self.exhausted:
+            self.refill()
+        return self.text[self.pos:]
+
+    def finish(self):
+        leftover = self.rest()
+        assert not leftover, (None, leftover)
+
+
+def parse_stream(parser, source, chunk_size=1 << 16):
+    # source is a text handle or an iterable of str chunks; a top-level
+    # sep_by or many yields its elements one by one, any other parser
+    # yields its single result once the input is consumed
+    stream = Stream(source, chunk_size)
+    kind, *args = getattr(parser, "node", (None,))
+    if kind == "regex" and args[2].node[0] == "many":
+        # stream the elements of a compiled many one at a time
+        many_node = args[2].node
+        parser = many(compile_parser(many_node[1]), many_node[2])
+        kind, *args = parser.node
+    if kind == "sep_by":
+        # chain splices the first element's result into the list
+        yield from stream.expect(args[0])
+        item, empty, parsed_any = args[2], True, True
+    elif kind == "many":
+        item, empty, parsed_any = args[0], args[1], False
+    else:
+        res = stream.expect(parser)
+        stream.finish()
+        yield res
+        return
+
+    while True:
+        tag, res = stream.step(item)
+        if tag != OK:
+            assert parsed_any or empty, (res, stream.rest())
+            break
+        parsed_any = True
+        yield res
+    stream.finish()
+
+
+# Compilation
+CHAR_LIKE, FLAT = "char_like", "flat"
+
+
+def regular(parser):
+    # (pattern, shape) if the parser matches a regular language and its result
+    # is the matched character (CHAR_LIKE) or the list of matched ones (FLAT)
+    kind, *args = getattr(parser, "node", (None,))
+    if kind == "char":
+        return re.escape(args[0]), CHAR_LIKE
+    if kind == "any_of":
+        if not args[0]:
+            return None
+        return "[" + "".join(map(re.escape, args[0])) + "]", CHAR_LIKE
+    if kind == "many":
+        child = regular(args[0])
+        if child is None or child[1] != CHAR_LIKE:
+            return None
+        return "(?:" + child[0] + (")*+" if args[1] else ")++"), FLAT
+    if kind in ("chain", "choice"):
+        children = [regular(arg) for arg in args]
+        if not children or None in children:
+            return None
+        patterns = [pattern for pattern, _ in children]
+        if kind == "chain":
+            return "".join(map("(?:{})".format, patterns)), FLAT
+        # choice is ordered and never backtracks into another alternative
+        shapes = {shape for _, shape in children}
+        if len(shapes) == 1:
+            return "(?>" + "|".join(patterns) + ")", shapes.pop()
+    return None
+
+
+def regex_parser(pattern, shape, original):
+    regex = re.compile(pattern)
+
+    # an alternation may have looked past the end of a successful match
+    alternates = "(?>" in pattern
+
+    def inner(state, pos):
+        if alternates and state.partial:
+            return original(state, pos)
+        match = regex.match(state.text, pos)
+        if match is None:
+            # errors carry the messages of the parser that failed
+            return original(state, pos)
+        if match.end() == len(state.text):
+            eof(state, match.end())
+        res = match.group() if shape == CHAR_LIKE else list(match.group())
+        return OK, res, match.end()
+    inner.node = "regex", pattern, shape, original
+    return inner
+
+
+def compile_parser(parser):
+    kind, *args = getattr(parser, "node", (None,))
+    if kind in ("many", "chain", "choice"):
+        compiled = regular(parser)
+        if compiled is not None:
+            return regex_parser(*compiled, parser)
+
+    if kind == "chain":
+        return chain(*map(compile_parser, args))
+    if kind == "choice":
+        return choice(*map(compile_parser, args))
+    if kind == "many":
+        return many(compile_parser(args[0]), args[1])
+    if kind == "sep_by":
+        return sep_by(compile_parser(args[0]), compile_parser(args[1]))
+    if kind == "skip":
+        return skip(compile_parser(args[0]))
+    if kind == "transform":
+        return transform(compile_parser(args[0]), args[1])
+    return parser
+
+
+def compile_benchmark(n_rows=10000, n_cols=20):
+    number = transform(many(any_of("0123456789"), empty=False),
+                       lambda ds: [int("".join(ds))])
+    grammar = sep_by(sep_by(number, char(",")), char("\n"))
+    text = "\n".join(",".join(str((row * n_cols + col) * 7919 % 100003)
+                              for col in range(n_cols))
+                     for row in range(n_rows))
+
+    timings = {}
+    for name, parser in [("combinators", grammar),
+                         ("compiled", compile_parser(grammar))]:
+        started = time.perf_counter()
+        res = parse(parser, text)
+        timings[name] = time.perf_counter() - started
+    assert parse(grammar, text) == res
+    return timings
@@ -1,64 +1,362 @@
+import asyncio
+import concurrent.futures
+import contextlib
+import decimal
 import functools
+import gc
+import glob
+import hashlib
+import importlib
+import inspect
+import io
+import json
+import math
+import os
+import pickle
+import random
+import reprlib
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, \
+    ThreadPoolExecutor, wait
+from itertools import count
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
 
 # First part
-def union(*args):
-    return functools.reduce(lambda x, y: x | y, args, set())
+BITSET_DENSITY = 32
 
 
-def digits(num):
-    if num == 0:
-        return [0]
-        
-    def step(list, cur_num):
-        if cur_num == 0:
-            return list
-        list.append(cur_num % 10)
-        return step(list, cur_num // 10)
-
-    return list(reversed(step([], num)))
-
-
-def lcm(*args):
-    def gcd(n, m):
-        while n != m:
-            if n > m:
-                n = n - m
-            else:
-                m = m - n
-        return n
+def union_arrays(arrays):
+    # bitset when the ids are dense enough, sorted merge otherwise
+    dtype = np.result_type(*arrays)
+    arrays = [a.ravel() for a in arrays if a.size]
+    if not arrays:
+        return np.empty(0, dtype)
+    low = min(a.min() for a in arrays)
+    high = max(a.max() for a in arrays)
+    if low >= 0 and high < BITSET_DENSITY * sum(a.size for a in arrays):
+        mask = np.zeros(int(high) + 1, dtype=bool)
+        for a in arrays:
+            mask[a] = True
+        return np.flatnonzero(mask).astype(dtype)
+    return np.unique(np.concatenate(arrays))
+
+
+def union(*args):
+    if np is not None and args and \
+            all(isinstance(a, np.ndarray) and a.dtype.kind in "iu"
+                for a in args):
+        if np.result_type(*args).kind in "iu":
+            return union_arrays(args)
+        # int64 and uint64 promote to float64, so mixed ids go to a set
+        args = [a.ravel().tolist() for a in args]
+    res = set()
+    res.update(*args)
+    return res
+
+
+DIGIT_VALUES = bytes.maketrans(b"0123456789", bytes(range(10)))
+DECIMAL_CUTOFF = 1 << 13
+
+
+def int_to_decimal(num):
+    # split by halves of the bit length and join the halves with decimal
+    # arithmetic, whose big multiplications are subquadratic
+    with decimal.localcontext() as ctx:
+        ctx.prec = decimal.MAX_PREC
+        ctx.Emax = decimal.MAX_EMAX
+        ctx.Emin = decimal.MIN_EMIN
+        powers = {}
+
+        def convert(n, width):
+            if width <= 2048:
+                return decimal.Decimal(n)
+            low_width = width >> 1
+            high = n >> low_width
+            low = n - (high << low_width)
+            if low_width not in powers:
+                powers[low_width] = decimal.Decimal(2) ** low_width
+            return convert(low, low_width) + \
+                convert(high, width - low_width) * powers[low_width]
+
+        return convert(num, num.bit_length())
 
-    def lcm_two(n, m):
-        return n * m / gcd(n, m)
 
-    return functools.reduce(lambda res, cur: lcm_two(res, cur), args)
+def digits(num):
+    num = abs(num)
+    if num.bit_length() <= DECIMAL_CUTOFF:
+        text = str(num)
+    else:
+        text = str(int_to_decimal(num))
+    return list(text.encode("ascii").translate(DIGIT_VALUES))
+
+
+def digits_matrix(nums):
+    # rows are right-aligned and padded with leading zeros
+    nums = np.abs(np.asarray(nums, dtype=np.int64))
+    width = len(str(int(nums.max()))) if len(nums) else 1
+    powers = 10 ** np.arange(width - 1, -1, -1, dtype=np.int64)
+    return (nums[:, None] // powers % 10).astype(np.uint8)
+
+
+def gcd(*args):
+    res = 0
+    for num in args:
+        res = math.gcd(res, num)
+        if res == 1:
+            break
+    return res
+
+
+def lcm_two(n, m):
+    if not n or not m:
+        return 0
+    return abs(n // math.gcd(n, m) * m)
+
+
+def tree_reduce(func, items):
+    # pairing neighbours keeps operands of similar size, so big products
+    # are not dragged through every step as with a left fold
+    items = list(items)
+    while len(items) > 1:
+        paired = [func(items[i], items[i + 1])
+                  for i in range(0, len(items) - 1, 2)]
+        if len(items) % 2:
+            paired.append(items[-1])
+        items = paired
+    return items[0]
+
+
+def lcm(*args, processes=None, chunk_size=1 << 16):
+    if processes is None or len(args) <= chunk_size:
+        return tree_reduce(lcm_two, args)
+    chunks = [args[i:i + chunk_size] for i in range(0, len(args), chunk_size)]
+    with ProcessPoolExecutor(processes) as pool:
+        parts = pool.map(functools.partial(tree_reduce, lcm_two), chunks)
+        return tree_reduce(lcm_two, parts)
+
+
+def lcm_benchmark(sizes=(10, 100, 1000)):
+    def lcm_by_subtraction(*args):
+        def gcd(n, m):
+            while n != m:
+                if n > m:
+                    n = n - m
+                else:
+                    m = m - n
+            return n
+        return functools.reduce(lambda n, m: n * m / gcd(n, m), args)
+
+    def fold(*args):
+        return functools.reduce(lcm_two, args)
+
+    timings = {}
+    for size in sizes:
+        args = range(2, size + 2)
+        for name, func in [("subtraction", lcm_by_subtraction),
+                           ("fold", fold), ("tree", lcm)]:
+            if name == "subtraction" and size > 20:
+                continue  # floats overflow and the loop takes ages
+            started = time.perf_counter()
+            func(*args)
+            timings[name, size] = time.perf_counter() - started
+    return timings
 
 
 def compose(*args):
-    def compose_two(f, g):
-        return lambda x: g(f(x))
-    return functools.reduce(compose_two, reversed(args))
+    # one flat loop over the stages, composed functions are spliced in
+    stages = []
+    for func in reversed(args):
+        stages.extend(getattr(func, "stages", (func,)))
+    head, tail = stages[0], stages[1:]
+
+    def inner(*args, **kwargs):
+        res = head(*args, **kwargs)
+        for stage in tail:
+            res = stage(res)
+        return res
+    inner.stages = tuple(stages)
+    return inner
 
 
 # Second part
 def once(func):
-    @functools.wraps(func)
-    def inner(*args, **kwargs):
-        if not inner.called:
-            inner.ret_val = func(*args, **kwargs)
-            inner.called = True
-        return inner.ret_val
+    # concurrent first calls run func once, the others wait for its result
+    lock = threading.Lock()
+
+    def record_wait(started):
+        with lock:
+            inner.blocked_time += time.perf_counter() - started
+            inner.blocked_calls += 1
+
+    def settle(future, task):
+        # runs in the loop of the first caller, the result is handed over
+        # through a thread-safe future that any loop can wait on
+        with lock:
+            if inner.future is future and (task.cancelled() or
+                                           task.exception() is not None):
+                inner.future = None
+            elif inner.future is future:
+                inner.ret_val = task.result()
+                inner.called = True
+        if task.cancelled():
+            future.cancel()
+        elif task.exception() is not None:
+            future.set_exception(task.exception())
+        else:
+            future.set_result(task.result())
+
+    if inspect.iscoroutinefunction(func):
+        @functools.wraps(func)
+        async def inner(*args, **kwargs):
+            while True:
+                if inner.called:
+                    return inner.ret_val
+                with lock:
+                    owner = inner.future is None
+                    if owner:
+                        inner.future = concurrent.futures.Future()
+                    future = inner.future
+                if owner:
+                    task = asyncio.ensure_future(func(*args, **kwargs))
+                    task.add_done_callback(functools.partial(settle, future))
+                started = time.perf_counter()
+                try:
+                    # shield, so a cancelled caller does not cancel the others
+                    return await asyncio.shield(asyncio.wrap_future(future))
+                except asyncio.CancelledError:
+                    # the owner's loop cancelled the call, e.g. when it shut
+                    # down, a caller that was not cancelled itself takes over
+                    if not future.cancelled() or \
+                            asyncio.current_task().cancelling():
+                        raise
+                finally:
+                    if not owner:
+                        record_wait(started)
+    else:
+        @functools.wraps(func)
+        def inner(*args, **kwargs):
+            if inner.called:
+                return inner.ret_val
+            started = time.perf_counter()
+            with inner.init_lock:
+                if inner.called:
+                    record_wait(started)
+                else:
+                    inner.ret_val = func(*args, **kwargs)
+                    inner.called = True
+            return inner.ret_val
+
+    def reset():
+        with inner.init_lock, lock:
+            inner.called = False
+            inner.ret_val = None
+            inner.future = None
+
+    inner.init_lock = threading.Lock()
     inner.called = False
+    inner.ret_val = None
+    inner.future = None
+    inner.blocked_time = 0.0
+    inner.blocked_calls = 0
+    inner.reset = reset
     return inner
 
 
-def trace_if(p):
+TraceEvent = namedtuple("TraceEvent",
+                        ["timestamp", "function", "args", "duration_ns"])
+
+
+class Tracer:
+    # sampled calls are kept in a fixed ring buffer that a background thread
+    # drains to sink; when the ring is full the oldest events are dropped
+    def __init__(self, sink, capacity=4096, every=1, probability=None,
+                 flush_interval=0.5):
+        self.sink = sink
+        self.events = [None] * capacity
+        self.written = 0
+        self.flushed = 0
+        self.dropped = 0
+        self.every = every
+        self.probability = probability
+        self.calls = count()
+        self.enabled = True
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.flusher = threading.Thread(target=self.flush_forever,
+                                        args=(flush_interval,), daemon=True)
+        self.flusher.start()
+
+    def sampled(self):
+        if self.probability is not None:
+            return random.random() < self.probability
+        return next(self.calls) % self.every == 0
+
+    def record(self, event):
+        with self.lock:
+            self.events[self.written % len(self.events)] = event
+            self.written += 1
+            if self.written - self.flushed > len(self.events):
+                self.dropped += self.written - self.flushed - len(self.events)
+                self.flushed = self.written - len(self.events)
+
+    def flush(self):
+        with self.lock:
+            events = [self.events[i % len(self.events)]
+                      for i in range(self.flushed, self.written)]
+            self.flushed = self.written
+        if events:
+            lines = "".join(json.dumps(event._asdict()) + "\n"
+                            for event in events)
+            if hasattr(self.sink, "sendall"):
+                self.sink.sendall(lines.encode())
+            else:
+                self.sink.write(lines)
+                self.sink.flush()
+
+    def flush_forever(self, interval):
+        while not self.stopped.wait(interval):
+            self.flush()
+
+    def close(self):
+        self.enabled = False
+        self.stopped.set()
+        self.flusher.join()
+        self.flush()
+
+
+def trace_if(p, tracer=None):
     def decorator(func):
+        if tracer is None:
+            @functools.wraps(func)
+            def inner(*args, **kwargs):
+                if p(*args, **kwargs):
+                    print(func.__name__, args, kwargs)
+                return func(*args, **kwargs)
+            return inner
+
         @functools.wraps(func)
         def inner(*args, **kwargs):
-            if p(*args, **kwargs):
-                print(func.__name__, args, kwargs)
-            return func(*args, **kwargs)
+            if not tracer.enabled or not tracer.sampled() or \
+                    not p(*args, **kwargs):
+                return func(*args, **kwargs)
+            started = time.perf_counter_ns()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                duration = time.perf_counter_ns() - started
+                tracer.record(TraceEvent(time.time(), func.__qualname__,
+                                         reprlib.repr((args, kwargs)),
+                                         duration))
         return inner
     return decorator
 
@@ -73,44 +371,359 @@ def n_times(n):
     return decorator
 
 
+BenchStats = namedtuple("BenchStats", ["name", "loops", "repeat", "min",
+                                       "median", "p95", "stddev"])
+CALIBRATION_NS = 10 ** 6
+
+
+def calibrate(call, target_ns=CALIBRATION_NS):
+    loops = 1
+    while True:
+        started = time.perf_counter_ns()
+        n_times(loops)(call)()
+        if time.perf_counter_ns() - started >= target_ns or loops >= 1 << 30:
+            return loops
+        loops *= 2
+
+
+def bench_stats(name, loops, samples):
+    p95 = statistics.quantiles(samples, n=20)[-1] if len(samples) > 1 \
+        else samples[0]
+    stddev = statistics.stdev(samples) if len(samples) > 1 else 0.0
+    return BenchStats(name, loops, len(samples), min(samples),
+                      statistics.median(samples), p95, stddev)
+
+
+def measure(func, *args, warmup=3, loops=None, repeat=None, min_time=0.2,
+            disable_gc=True, **kwargs):
+    call = functools.partial(func, *args, **kwargs)
+    n_times(warmup)(call)()
+    gc_enabled = gc.isenabled()
+    if disable_gc:
+        gc.disable()
+    try:
+        if loops is None:
+            loops = calibrate(call)
+        samples = []
+        deadline = time.perf_counter_ns() + int(min_time * 1e9)
+        while len(samples) < (repeat or 5) or \
+                repeat is None and time.perf_counter_ns() < deadline:
+            started = time.perf_counter_ns()
+            n_times(loops)(call)()
+            samples.append((time.perf_counter_ns() - started) / loops)
+    finally:
+        if gc_enabled:
+            gc.enable()
+    return bench_stats(getattr(func, "__qualname__", repr(func)), loops,
+                       samples)
+
+
+def benchmark(**options):
+    def decorator(func):
+        @functools.wraps(func)
+        def inner(*args, **kwargs):
+            return measure(func, *args, **options, **kwargs)
+        return inner
+    return decorator
+
+
+def compare(candidates, *args, **options):
+    if not isinstance(candidates, dict):
+        candidates = {getattr(func, "__qualname__", repr(func)): func
+                      for func in candidates}
+    results = {}
+    for name, func in candidates.items():
+        results[name] = measure(func, *args, **options)._replace(name=name)
+    return results
+
+
+def bench_report(results, path=None):
+    fastest = min(stats.median for stats in results.values())
+    report = {"python": sys.version.split()[0], "unit": "ns",
+              "results": {name: dict(stats._asdict(),
+                                     relative=stats.median / fastest)
+                          for name, stats in results.items()}}
+    if path is not None:
+        with open(path, "w") as handle:
+            json.dump(report, handle, indent=2)
+    return report
+
+
+def sibling(name):
+    # works both as a script next to the other solutions and as a module
+    # of the solutions package
+    return importlib.import_module(f"{__package__}.{name}" if __package__
+                                   else name)
+
+
+def hot_helpers(path=None, **options):
+    maze = sibling("vladimir_mazin_01")
+    parsing = sibling("vladimir_mazin_02")
+    caching = sibling("vladimir_mazin_05")
+    ook = sibling("vladimir_mazin_07")
+
+    def cached_fib(n):
+        @caching.lru_cache(maxsize=n)
+        def fib(k):
+            return k if k < 2 else fib(k - 1) + fib(k - 2)
+        return fib(n)
+
+    def ook_eval():
+        with contextlib.redirect_stdout(io.StringIO()):
+            ook.ook_eval(ook.test_str, memory_limit=64)
+
+    number = parsing.transform(
+        parsing.many(parsing.any_of("0123456789"), empty=False),
+        lambda ds: [int("".join(ds))])
+    grammar = parsing.sep_by(number, parsing.char(","))
+    text = ",".join(str(i * 7919 % 100003) for i in range(200))
+    compiled = parsing.compile_parser(grammar)
+
+    rnd = random.Random(0)
+    with tempfile.NamedTemporaryFile("w", suffix=".txt",
+                                     delete=False) as handle:
+        handle.write("\n".join("".join(rnd.choice("ACGT") for _ in range(64))
+                               for _ in range(64)))
+    try:
+        suites = {
+            "lru_cache": {"fib": functools.partial(cached_fib, 200)},
+            "ook_eval": {"hello_world": ook_eval},
+            "parser": {
+                "combinators": functools.partial(parsing.parse, grammar,
+                                                 text),
+                "compiled": functools.partial(parsing.parse, compiled, text)},
+            "hba1": {
+                name: functools.partial(maze.hba1, handle.name, distance)
+                for name, distance in [("hamming", maze.hamming),
+                                       ("distance1", maze.distance1)]}}
+        report = {name: bench_report(compare(candidates, **options))
+                  for name, candidates in suites.items()}
+    finally:
+        os.remove(handle.name)
+    if path is not None:
+        with open(path, "w") as handle:
+            json.dump(report, handle, indent=2)
+    return report
+
+
 # Third and forth parts
-def project():
-    def register(func=None, *, depends_on=None):
+ScheduleReport = namedtuple("ScheduleReport", ["wall_times", "critical_path",
+                                               "critical_time", "cached"])
+
+
+def timed(func, *args):
+    started = time.perf_counter()
+    res = func(*args)
+    return res, time.perf_counter() - started
+
+
+def code_fingerprint(code):
+    parts = [code.co_code, repr(code.co_names).encode()]
+    for const in code.co_consts:
+        if hasattr(const, "co_code"):
+            parts.append(code_fingerprint(const))
+        else:
+            parts.append(repr(const).encode())
+    return hashlib.sha256(b"\0".join(parts)).digest()
+
+
+def input_fingerprint(path):
+    try:
+        with open(path, "rb") as file:
+            return hashlib.file_digest(file, "sha256").digest()
+    except FileNotFoundError:
+        return b"missing"
+
+
+def project(workers=4, cache_dir=None):
+    def register(func=None, *, depends_on=None, inputs=None):
         depends_on = depends_on or []
+        inputs = inputs or []
 
         # with brackets
         if func is None:
-            return lambda func: register(func, depends_on=depends_on)
+            return lambda func: register(func, depends_on=depends_on,
+                                         inputs=inputs)
 
         # without brackets
         register.registered.append(func.__name__)
         register.get_all = lambda: register.registered[:]
         register.name_to_func[func.__name__] = func
         func.depends_on = depends_on
+        func.inputs = inputs
         func.get_dependencies = lambda: func.depends_on[:]
 
         @functools.wraps(func)
         def inner():
-            for dep in func.get_dependencies():
-                if dep not in register.satisfied_dependencies:
-                    register.name_to_func[dep]()
-                    register.satisfied_dependencies.add(dep)
+            register.run(*func.get_dependencies())
             register.satisfied_dependencies.add(func.__name__)
-            return func()
+            return execute(func.__name__)[0]
         return inner
+
+    def fingerprint(name, known=None):
+        # code, declared input files and the fingerprints of dependencies
+        known = {} if known is None else known
+        if name not in known:
+            func = register.name_to_func[name]
+            parts = [code_fingerprint(func.__code__)]
+            for path in func.inputs:
+                # an input shared by several tasks is read once per run
+                if ("input", path) not in known:
+                    known["input", path] = input_fingerprint(path)
+                parts.append(known["input", path])
+            parts.extend(fingerprint(dep, known).encode()
+                         for dep in sorted(func.depends_on))
+            known[name] = hashlib.sha256(b"".join(parts)).hexdigest()
+        return known[name]
+
+    def cache_path(name, known=None):
+        return os.path.join(register.cache_dir,
+                            f"{name}-{fingerprint(name, known)}.pickle")
+
+    def execute(name, known=None):
+        # (result, whether it came from the cache); known holds the
+        # fingerprints of one run, dependencies finish first and are
+        # hashed once
+        func = register.name_to_func[name]
+        if register.cache_dir is None:
+            return func(), False
+        path = cache_path(name, known)
+        if os.path.exists(path):
+            with open(path, "rb") as file:
+                return pickle.load(file), True
+        res = func()
+        os.makedirs(register.cache_dir, exist_ok=True)
+        with tempfile.NamedTemporaryFile("wb", dir=register.cache_dir,
+                                         delete=False) as file:
+            pickle.dump(res, file)
+        os.replace(file.name, path)
+        return res, False
+
+    def invalidate(name):
+        # drops cached results of name and every task depending on it
+        stale = {name}
+        changed = True
+        while changed:
+            changed = False
+            for other, func in register.name_to_func.items():
+                if other not in stale and stale & set(func.depends_on):
+                    stale.add(other)
+                    changed = True
+        for other in stale:
+            register.satisfied_dependencies.discard(other)
+            if register.cache_dir is not None:
+                pattern = os.path.join(register.cache_dir,
+                                       glob.escape(other) + "-*.pickle")
+                for path in glob.glob(pattern):
+                    os.remove(path)
+        return stale
+
+    def plan(names):
+        # unsatisfied tasks needed for names and their unsatisfied deps
+        deps = {}
+        stack = list(names)
+        while stack:
+            name = stack.pop()
+            if name not in register.name_to_func:
+                raise ValueError(f"unknown task {name!r}")
+            if name in register.satisfied_dependencies or name in deps:
+                continue
+            deps[name] = set(register.name_to_func[name].depends_on) - \
+                register.satisfied_dependencies
+            stack.extend(deps[name])
+
+        dependents = {name: [] for name in deps}
+        for name in deps:
+            for dep in deps[name]:
+                dependents[dep].append(name)
+        order = []
+        waiting = {name: len(deps[name]) for name in deps}
+        ready = [name for name in deps if not waiting[name]]
+        while ready:
+            name = ready.pop()
+            order.append(name)
+            for other in dependents[name]:
+                waiting[other] -= 1
+                if not waiting[other]:
+                    ready.append(other)
+        if len(order) != len(deps):
+            cycle = sorted(set(deps) - set(order))
+            raise ValueError(f"dependency cycle among {cycle}")
+        return order, deps, dependents
+
+    def run(*names, workers=None):
+        order, deps, dependents = plan(names or register.registered)
+        waiting = {name: len(deps[name]) for name in order}
+        ready = [name for name in order if not waiting[name]]
+        running = {}
+        wall_times = {}
+        cached = set()
+        known = {}
+
+        with ThreadPoolExecutor(workers or register.workers) as pool:
+            while ready or running:
+                for name in ready:
+                    running[pool.submit(timed, execute, name, known)] = name
+                ready = []
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    (_, from_cache), wall_times[name] = future.result()
+                    if from_cache:
+                        cached.add(name)
+                    register.satisfied_dependencies.add(name)
+                    for other in dependents[name]:
+                        waiting[other] -= 1
+                        if not waiting[other]:
+                            ready.append(other)
+
+        # the longest chain of dependent tasks bounds the total run time
+        finish, previous = {}, {}
+        for name in order:
+            previous[name] = max(deps[name], key=finish.get, default=None)
+            finish[name] = wall_times[name] + finish.get(previous[name], 0)
+        last = max(order, key=finish.get, default=None)
+        critical_time = finish.get(last, 0)
+        path = []
+        while last is not None:
+            path.append(last)
+            last = previous[last]
+        report = ScheduleReport(wall_times, path[::-1], critical_time, cached)
+        register.last_report = report
+        return report
+
     register.registered = []
     register.name_to_func = {}
     register.satisfied_dependencies = set()
+    register.workers = workers
+    register.cache_dir = cache_dir
+    register.run = run
+    register.invalidate = invalidate
+    register.fingerprint = fingerprint
+    register.last_report = None
     return register
 
 # Asserts
 assert_msg = "Dont send!!!"
 
 assert union({1, 2, 3}, {10}, {2, 6}) == {1, 2, 3, 6, 10}, assert_msg
+assert union() == set() and union({1}, [1, 2], range(3)) == {0, 1, 2}, \
+    assert_msg
+if np is not None:
+    assert union(np.array([5, 1]), np.array([], dtype=int),
+                 np.array([[3, 5]])).tolist() == [1, 3, 5], assert_msg
+    assert union(np.array([10 ** 9, -1]), np.array([2])).tolist() == \
+        [-1, 2, 10 ** 9], assert_msg
+    assert union(np.array([1, 2], dtype=np.uint64), np.array([[3, -1]])) == \
+        {-1, 1, 2, 3}, assert_msg
 
 assert digits(0) == [0] and digits(1914) == [1, 9, 1, 4], assert_msg
+assert digits(10 ** 5000) == [1] + [0] * 5000, assert_msg
 
 assert lcm(100500, 42) == 703500 and lcm(*range(2, 40, 8)) == 19890, assert_msg
+assert lcm(10 ** 12, 3) == 3 * 10 ** 12 and lcm(2 ** 60 + 1, 3) % 3 == 0, \
+    assert_msg
+assert gcd(12, 18, 30) == 6 and gcd() == 0, assert_msg
 
 test_f = compose(lambda x: 2 * x, lambda x: x + 1, lambda x: x % 9)
 assert test_f(42) == 14, assert_msg
@@ -122,6 +735,65 @@ def initialize_settings():
     return {"token": 42}
 
 
+test_once_calls = []
+
+
+@once
+def test_slow_init():
+    time.sleep(0.05)
+    test_once_calls.append("sync")
+    return len(test_once_calls)
+
+
+with ThreadPoolExecutor(8) as test_pool:
+    assert list(test_pool.map(lambda _: test_slow_init(), range(8))) == \
+        [1] * 8, assert_msg
+assert test_once_calls == ["sync"], assert_msg
+test_slow_init.reset()
+assert test_slow_init() == 2, assert_msg
+
+
+@once
+async def test_async_init():
+    await asyncio.sleep(0.1)
+    test_once_calls.append("async")
+    return "ready"
+
+
+async def test_gather():
+    return await asyncio.gather(*[test_async_init() for _ in range(4)])
+
+
+with ThreadPoolExecutor(2) as test_pool:
+    # the second event loop joins the task started by the first one
+    test_first = test_pool.submit(asyncio.run, test_gather())
+    time.sleep(0.02)
+    test_second = test_pool.submit(asyncio.run, test_async_init())
+    assert test_first.result() == ["ready"] * 4, assert_msg
+    assert test_second.result() == "ready", assert_msg
+assert test_once_calls.count("async") == 1, assert_msg
+
+test_async_init.reset()
+with ThreadPoolExecutor(2) as test_pool:
+    # the first loop gives up and shuts down, cancelling the shared call,
+    # the caller on the second loop restarts it instead of failing
+    test_first = test_pool.submit(
+        asyncio.run, asyncio.wait_for(test_async_init(), 0.05))
+    time.sleep(0.02)
+    test_second = test_pool.submit(asyncio.run, test_async_init())
+    try:
+        test_first.result()
+        assert False, assert_msg
+    except TimeoutError:
+        pass
+    assert test_second.result() == "ready", assert_msg
+assert test_once_calls.count("async") == 2, assert_msg
+assert asyncio.run(test_async_init()) == "ready", assert_msg
+test_async_init.reset()
+asyncio.run(test_async_init())
+assert test_once_calls.count("async") == 3, assert_msg
+
+
 @trace_if(lambda x, y, **kwargs: kwargs.get("integral"))
 def div(x, y, integral=False):
     return x // y if integral else x / y
@@ -151,3 +823,56 @@ def do_third_thing():
 assert register.get_all() == ["do_something", "do_other_thing", "do_third_thing"], assert_msg
 assert do_something.get_dependencies() == [], assert_msg
 assert do_other_thing.get_dependencies() == ["do_something"], assert_msg
+
+test_register = project()
+test_calls = []
+
+
+@test_register
+def fetch():
+    test_calls.append("fetch")
+
+
+@test_register(depends_on=["fetch"])
+def parse():
+    test_calls.append("parse")
+
+
+@test_register(depends_on=["parse"])
+def report():
+    test_calls.append("report")
+
+
+report()
+assert test_calls == ["fetch", "parse", "report"], assert_msg
+assert test_register.run().wall_times == {}, assert_msg
+
+with tempfile.TemporaryDirectory() as test_dir:
+    test_register = project(cache_dir=test_dir)
+    test_input = os.path.join(test_dir, "input.txt")
+    with open(test_input, "w") as test_file:
+        test_file.write("data")
+
+    @test_register(inputs=[test_input])
+    def load():
+        return 1
+
+    @test_register(depends_on=["load"], inputs=[test_input])
+    def total():
+        return 2
+
+    assert test_register.run().cached == set(), assert_msg
+    test_register.satisfied_dependencies.clear()
+    assert test_register.run().cached == {"load", "total"}, assert_msg
+
+test_stats = measure(sum, range(100), repeat=7, loops=10)
+assert (test_stats.name, test_stats.loops, test_stats.repeat) == \
+    ("sum", 10, 7), assert_msg
+assert 0 < test_stats.min <= test_stats.median <= test_stats.p95, assert_msg
+assert gc.isenabled(), assert_msg
+test_results = compare({"sum": sum, "len": len}, [1, 2, 3], min_time=0.01)
+assert list(test_results) == ["sum", "len"], assert_msg
+assert len(compare([sum, functools.partial(max, default=0)], [1, 2, 3],
+                   min_time=0.01)) == 2, assert_msg
+assert min(entry["relative"] for entry in
+           bench_report(test_results)["results"].values()) == 1, assert_msg
@@ -1,7 +1,24 @@
 import gzip
 import bz2
+import bisect
+import functools
+import hashlib
+import heapq
+import io
+import lzma
+import mmap
+import os
 import random
-from collections import defaultdict
+import re
+import struct
+import tempfile
+import time
+import zlib
+from array import array
+from collections import Counter, defaultdict, deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from itertools import accumulate, chain, repeat
+from operator import and_, rshift
 
 
 # First part
@@ -36,24 +53,485 @@ def find_all(s, sub_s):
     return res
 
 
-def common_prefix(first, second, *args):
-    prefix = []
-    for chars in zip(first, second, *args):
-        if all(map(lambda ch: ch == chars[0], chars)):
-            prefix.append(chars[0])
+def build_automaton(keys, patterns):
+    goto, out = [{}], [()]
+    for key, pattern in zip(keys, patterns):
+        state = 0
+        for symbol in key:
+            if symbol not in goto[state]:
+                goto[state][symbol] = len(goto)
+                goto.append({})
+                out.append(())
+            state = goto[state][symbol]
+        out[state] = ((len(key), pattern),)
+
+    fail = [0] * len(goto)
+    queue = deque(goto[0].values())
+    while queue:
+        state = queue.popleft()
+        for symbol, child in goto[state].items():
+            queue.append(child)
+            link = fail[state]
+            while link and symbol not in goto[link]:
+                link = fail[link]
+            fail[child] = goto[link].get(symbol, 0)
+            out[child] += out[fail[child]]
+    return goto, fail, out
+
+
+class PatternMatcher:
+    # Aho-Corasick over str or utf-8 bytes, matches may overlap like in
+    # find_all and are yielded in the order their last symbol is read
+    def __init__(self, patterns):
+        self.patterns = list(dict.fromkeys(patterns))
+        if not all(self.patterns):
+            raise ValueError("Empty pattern matches everywhere")
+        self.automata = {}
+
+    def automaton(self, kind):
+        if kind not in self.automata:
+            keys = self.patterns if kind is str else \
+                [p.encode() for p in self.patterns]
+            self.automata[kind] = build_automaton(keys, self.patterns)
+        return self.automata[kind]
+
+    def finditer(self, chunks, offset=0):
+        state = 0
+        for chunk in chunks:
+            kind = str if isinstance(chunk, str) else bytes
+            goto, fail, out = self.automaton(kind)
+            for i, symbol in enumerate(chunk, offset):
+                while state and symbol not in goto[state]:
+                    state = fail[state]
+                state = goto[state].get(symbol, 0)
+                if out[state]:
+                    for length, pattern in out[state]:
+                        yield i - length + 1, pattern
+            offset += len(chunk)
+
+    def find_all(self, s):
+        res = {pattern: [] for pattern in self.patterns}
+        for i, pattern in self.finditer([s]):
+            res[pattern].append(i)
+        return {pattern: sorted(found) for pattern, found in res.items()}
+
+    def find_file(self, filename, **kwargs):
+        # offsets are in bytes of the decompressed content
+        return self.finditer(read_chunks(filename, **kwargs))
+
+
+def search_benchmark(n_patterns=10000, text_size=1 << 20, seed=0):
+    rnd = random.Random(seed)
+    text = "".join(rnd.choice("abcdefgh ") for _ in range(text_size))
+    patterns = {"".join(rnd.choice("abcdefgh")
+                        for _ in range(rnd.randint(3, 8)))
+                for _ in range(n_patterns)}
+
+    timings = {}
+    started = time.perf_counter()
+    looped = {pattern: find_all(text, pattern) for pattern in patterns}
+    timings["find_all"] = time.perf_counter() - started
+    started = time.perf_counter()
+    matched = PatternMatcher(patterns).find_all(text)
+    timings["aho_corasick"] = time.perf_counter() - started
+    assert looped == matched
+    return timings
+
+
+def lcp_length(a, b):
+    # binary search over slice comparisons, which run in C
+    lo, hi = 0, min(len(a), len(b))
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if a[:mid] == b[:mid]:
+            lo = mid
         else:
-            return ''.join(prefix)
+            hi = mid - 1
+    return lo
+
+
+def common_prefix(first, second, *args):
+    # the lexicographic extremes differ first where any two strings do
+    lo, hi = min(first, second, *args), max(first, second, *args)
+    return lo[:lcp_length(lo, hi)]
+
+
+class PrefixIndex:
+    def __init__(self, keys):
+        self.keys = sorted(set(keys))
+        self.rank = {key: i for i, key in enumerate(self.keys)}
+        # lcp[i] is shared by keys i - 1 and i, sparse[k][i] is the
+        # minimum of lcp[i:i + 2 ** k]
+        self.lcp = [0] + [lcp_length(a, b)
+                          for a, b in zip(self.keys, self.keys[1:])]
+        self.sparse = [self.lcp]
+        width = 1
+        while 2 * width <= len(self.lcp):
+            level = self.sparse[-1]
+            self.sparse.append(list(map(min, level, level[width:])))
+            width *= 2
+        self.by_lcp = sorted(range(1, len(self.lcp)),
+                             key=self.lcp.__getitem__)
+        self.lcp_values = [self.lcp[i] for i in self.by_lcp]
+
+    def range_lcp(self, lo, hi):
+        if lo == hi:
+            return len(self.keys[lo])
+        level = (hi - lo).bit_length() - 1
+        return min(self.sparse[level][lo + 1],
+                   self.sparse[level][hi - (1 << level) + 1])
+
+    def common_prefix(self, subset):
+        ranks = [self.rank[key] for key in subset]
+        lo, hi = min(ranks), max(ranks)
+        return self.keys[lo][:self.range_lcp(lo, hi)]
+
+    def groups(self, n):
+        # keys sharing their first n characters are adjacent in sorted
+        # order, so groups split exactly where the neighbour lcp drops
+        # below n
+        breaks = self.by_lcp[:bisect.bisect_left(self.lcp_values, n)]
+        bounds = [0] + sorted(breaks) + [len(self.keys)]
+        res = {}
+        for lo, hi in zip(bounds, bounds[1:]):
+            if lo < hi and len(self.keys[lo]) >= n:
+                prefix = self.keys[lo][:self.range_lcp(lo, hi - 1)]
+                res[prefix] = self.keys[lo:hi]
+        return res
 
 
 # Second part
+Codec = namedtuple("Codec", ["magic", "decompressor", "open"])
+CODECS = {
+    ".gz": Codec(b"\x1f\x8b\x08", lambda: zlib.decompressobj(31), gzip.open),
+    ".bz2": Codec(b"BZh", bz2.BZ2Decompressor, bz2.open),
+    ".xz": Codec(b"\xfd7zXZ\x00", lzma.LZMADecompressor, lzma.open),
+}
+CHUNK_SIZE = 1 << 20
+READ_STEP = 1 << 16
+
+
+def codec_for(filename):
+    for suffix, codec in CODECS.items():
+        if filename.endswith(suffix):
+            return suffix
+    return None
+
+
 def reader(filename, **kwargs):
-    if filename.endswith(".gz"):
-        return gzip.open(filename, **kwargs)
-    if filename.endswith(".bz2"):
-        return bz2.open(filename, **kwargs)
+    suffix = codec_for(filename)
+    if suffix is not None:
+        return CODECS[suffix].open(filename, **kwargs)
     return open(filename, **kwargs)
 
 
+def mapped(filename):
+    with open(filename, "rb") as handle:
+        if os.fstat(handle.fileno()).st_size == 0:
+            return b""
+        return mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def skip_padding(view, pos):
+    while pos < len(view) and view[pos] == 0:
+        pos += 1
+    return pos
+
+
+def inflate(view, suffix, pos, chunk_size=READ_STEP):
+    # yields the decompressed pieces of one member and returns its end,
+    # small reads keep the overshoot into the next member cheap
+    decompressor = CODECS[suffix].decompressor()
+    while not decompressor.eof:
+        if pos >= len(view):
+            raise EOFError("Compressed file ended before the "
+                           "end-of-stream marker was reached")
+        piece = view[pos:pos + chunk_size]
+        pos += len(piece)
+        yield decompressor.decompress(piece)
+    return pos - len(decompressor.unused_data)
+
+
+MemberUnit = namedtuple("MemberUnit", ["start", "end", "size", "before",
+                                       "after"])
+
+
+def inflate_unit(view, suffix, unit, chunk_size=READ_STEP):
+    # a member with known bounds, before and after complete it when it is
+    # a block cut out of a larger stream
+    decompressor = CODECS[suffix].decompressor()
+    pieces = chain([unit.before],
+                   (view[pos:min(pos + chunk_size, unit.end)]
+                    for pos in range(unit.start, unit.end, chunk_size)),
+                   [unit.after])
+    for piece in pieces:
+        if piece:
+            yield decompressor.decompress(piece)
+    if not decompressor.eof or decompressor.unused_data:
+        raise OSError(f"Corrupt member at offset {unit.start}")
+
+
+def inflate_units(filename, suffix, units):
+    view = mapped(filename)
+    return [b"".join(inflate_unit(view, suffix, unit)) for unit in units]
+
+
+def inflate_candidate(filename, suffix, start):
+    # (start, end, data) of a possible member, end is None when start is
+    # not one and data is None when it decodes to more than a task
+    view = mapped(filename)
+    pieces = inflate(view, suffix, start)
+    res = []
+    size = 0
+    try:
+        while size <= TASK_BYTES:
+            res.append(next(pieces))
+            size += len(res[-1])
+    except StopIteration as stop:
+        return start, stop.value, b"".join(res)
+    except (EOFError, OSError, zlib.error, lzma.LZMAError):
+        return start, None, b""
+    return start, start, None
+
+
+def le_int(view, pos, size):
+    return int.from_bytes(view[pos:pos + size], "little")
+
+
+def bgzf_bounds(view):
+    # BGZF blocks carry their compressed size in the BC extra subfield and
+    # the decompressed size in the ISIZE trailer, nothing gets decoded here
+    bounds = []
+    pos = 0
+    while pos < len(view):
+        if view[pos:pos + 4] != CODECS[".gz"].magic + b"\x04":
+            return None
+        extra_end = pos + 12 + le_int(view, pos + 10, 2)
+        size = None
+        field = pos + 12
+        while field + 4 <= extra_end:
+            field_size = le_int(view, field + 2, 2)
+            if view[field:field + 2] == b"BC" and field_size == 2:
+                size = le_int(view, field + 4, 2) + 1
+            field += 4 + field_size
+        if size is None or pos + size > len(view):
+            return None
+        bounds.append(MemberUnit(pos, pos + size,
+                                 le_int(view, pos + size - 4, 4), b"", b""))
+        pos += size
+    return bounds
+
+
+def varint(view, pos):
+    res = shift = 0
+    while True:
+        byte = view[pos]
+        res |= (byte & 0x7f) << shift
+        pos += 1
+        shift += 7
+        if byte < 0x80:
+            return res, pos
+
+
+def varint_bytes(n):
+    res = bytearray()
+    while n >= 0x80:
+        res.append(n & 0x7f | 0x80)
+        n >>= 7
+    res.append(n)
+    return bytes(res)
+
+
+def xz_tail(flags, unpadded, uncompressed):
+    # index and footer of a stream holding just one block
+    index = b"\x00\x01" + varint_bytes(unpadded) + varint_bytes(uncompressed)
+    index += b"\x00" * (-len(index) % 4)
+    index += zlib.crc32(index).to_bytes(4, "little")
+    footer = (len(index) // 4 - 1).to_bytes(4, "little") + flags
+    return index + zlib.crc32(footer).to_bytes(4, "little") + footer + b"YZ"
+
+
+def xz_bounds(view):
+    # walks the streams backwards: each footer gives the index size, the
+    # index gives the sizes of the blocks in front of it; every block is
+    # decoded on its own, wrapped into a stream of one block
+    streams = []
+    end = len(view)
+    while end > 0:
+        while end >= 4 and view[end - 4:end] == b"\x00" * 4:
+            end -= 4
+        if end < 32 or view[end - 2:end] != b"YZ":
+            return None
+        index = end - 12 - (le_int(view, end - 8, 4) + 1) * 4
+        if index < 12 or view[index] != 0:
+            return None
+        n_records, pos = varint(view, index + 1)
+        records = []
+        for _ in range(n_records):
+            unpadded, pos = varint(view, pos)
+            uncompressed, pos = varint(view, pos)
+            records.append((unpadded, uncompressed))
+        start = index - sum(-(-unpadded // 4) * 4
+                            for unpadded, _ in records) - 12
+        if start < 0 or view[start:start + 6] != CODECS[".xz"].magic:
+            return None
+        streams.append((start, records))
+        end = start
+
+    bounds = []
+    for start, records in reversed(streams):
+        header = bytes(view[start:start + 12])
+        pos = start + 12
+        for unpadded, uncompressed in records:
+            end = pos + -(-unpadded // 4) * 4
+            bounds.append(MemberUnit(pos, end, uncompressed, header,
+                                     xz_tail(header[6:8], unpadded,
+                                             uncompressed)))
+            pos = end
+    return bounds
+
+
+MEMBER_BOUNDS = {".gz": bgzf_bounds, ".xz": xz_bounds}
+# gzip flags keep their top three bits clear, bzip2 streams open with a
+# block header unless they are empty
+MEMBER_STARTS = {".gz": re.compile(rb"\x1f\x8b\x08[\x00-\x1f]"),
+                 ".bz2": re.compile(rb"BZh[1-9]1AY&SY")}
+TASK_BYTES = 1 << 22
+
+
+def member_starts(view, pattern):
+    for match in pattern.finditer(view):
+        yield match.start()
+
+
+def member_tasks(units):
+    # runs of small members go to the workers together, a member bigger
+    # than a task is streamed by the parent instead of returned whole
+    task, size = [], 0
+    for unit in units:
+        if task and (unit.size > TASK_BYTES or size + unit.size > TASK_BYTES):
+            yield task
+            task, size = [], 0
+        if unit.size > TASK_BYTES:
+            yield unit
+        else:
+            task.append(unit)
+            size += unit.size
+    if task:
+        yield task
+
+
+def serial_members(view, suffix, chunk_size, pos=0, stop=None):
+    # members from pos on, up to the first one ending at or after stop
+    stop = len(view) if stop is None else stop
+    pos = skip_padding(view, pos)
+    while pos < stop:
+        pos = yield from inflate(view, suffix, pos,
+                                 min(chunk_size, READ_STEP))
+        pos = skip_padding(view, pos)
+    return pos
+
+
+def known_members(filename, view, suffix, units, processes, chunk_size):
+    def collect(item):
+        if isinstance(item, MemberUnit):
+            yield from inflate_unit(view, suffix, item,
+                                    min(chunk_size, READ_STEP))
+        else:
+            yield from item.result()
+
+    pool = ProcessPoolExecutor(processes)
+    window = 2 * processes
+    pending = deque()
+    try:
+        for task in member_tasks(units):
+            pending.append(task if isinstance(task, MemberUnit) else
+                           pool.submit(inflate_units, filename, suffix, task))
+            if len(pending) >= window:
+                yield from collect(pending.popleft())
+        while pending:
+            yield from collect(pending.popleft())
+    finally:
+        pool.shutdown(cancel_futures=True)
+
+
+def candidate_members(filename, view, suffix, processes, chunk_size):
+    # every signature match is a candidate member start; collecting in
+    # order drops the ones inside another member and decodes whatever
+    # the workers could not return, like members the scan missed or
+    # ones bigger than a task, in the parent
+    def collect(future, expected):
+        start, end, data = future.result()
+        expected = yield from serial_members(view, suffix, chunk_size,
+                                             expected, start)
+        if start < expected:
+            return expected
+        if end is None:
+            raise OSError(f"Corrupt member at offset {start}")
+        if data is None:
+            end = yield from inflate(view, suffix, start,
+                                     min(chunk_size, READ_STEP))
+        else:
+            yield data
+        return skip_padding(view, end)
+
+    pool = ProcessPoolExecutor(processes)
+    window = 2 * processes
+    pending = deque()
+    expected = skip_padding(view, 0)
+    try:
+        for start in member_starts(view, MEMBER_STARTS[suffix]):
+            pending.append(pool.submit(inflate_candidate, filename, suffix,
+                                       start))
+            if len(pending) >= window:
+                expected = yield from collect(pending.popleft(), expected)
+        while pending:
+            expected = yield from collect(pending.popleft(), expected)
+    finally:
+        pool.shutdown(cancel_futures=True)
+    yield from serial_members(view, suffix, chunk_size, expected)
+
+
+def read_chunks(filename, chunk_size=CHUNK_SIZE, processes=None):
+    view = mapped(filename)
+    suffix = codec_for(filename)
+    if suffix is None:
+        for pos in range(0, len(view), chunk_size):
+            yield view[pos:pos + chunk_size]
+        return
+
+    # recorded bounds (BGZF, xz blocks) are split exactly, plain gzip and
+    # bzip2 members are found by signature, anything else is serial
+    processes = processes or os.cpu_count()
+    pieces = serial_members(view, suffix, chunk_size)
+    units = None
+    if processes > 1 and suffix in MEMBER_BOUNDS:
+        units = MEMBER_BOUNDS[suffix](view)
+    if units is not None:
+        if len(units) > 1:
+            pieces = known_members(filename, view, suffix, units, processes,
+                                   chunk_size)
+    elif processes > 1 and suffix in MEMBER_STARTS:
+        starts = member_starts(view, MEMBER_STARTS[suffix])
+        if next(starts, None) is not None and next(starts, None) is not None:
+            pieces = candidate_members(filename, view, suffix, processes,
+                                       chunk_size)
+    for piece in pieces:
+        if piece:
+            yield piece
+
+
+def read_lines(filename, encoding="utf-8", **kwargs):
+    rest = b""
+    for chunk in read_chunks(filename, **kwargs):
+        lines = (rest + chunk).split(b"\n")
+        rest = lines.pop()
+        for line in lines:
+            yield (line + b"\n").decode(encoding)
+    if rest:
+        yield rest.decode(encoding)
+
+
 def parse_shebang(filename):
     first_line = open(filename).readline()
     if first_line.startswith("#!"):
@@ -65,6 +543,169 @@ def words(handle):
     return [w for line in handle for w in line.split(" ")]
 
 
+WORD_BITS = 32
+WORD_MASK = (1 << WORD_BITS) - 1
+SHARD_SIZE = 1 << 26
+TRIGRAM_BUFFER = 1 << 18
+MERGE_FANIN = 16
+
+
+def pack(w1, w2, w3):
+    return (w1 << WORD_BITS | w2) << WORD_BITS | w3
+
+
+def trigram_run(counts):
+    # sorted packed trigrams as state, successor and count arrays
+    keys = sorted(counts)
+    return (array("Q", map(rshift, keys, repeat(WORD_BITS))),
+            array("I", map(and_, keys, repeat(WORD_MASK))),
+            array("I", map(counts.__getitem__, keys)))
+
+
+def merge_runs(runs):
+    # k-way merge of sorted runs, equal transitions added up
+    states, successors, counts = run = array("Q"), array("I"), array("I")
+    add_state, add_successor, add_count = \
+        states.append, successors.append, counts.append
+    last = None
+    for state, successor, n in heapq.merge(*(zip(*run) for run in runs)):
+        if (state, successor) == last:
+            counts[-1] += n
+        else:
+            last = state, successor
+            add_state(state)
+            add_successor(successor)
+            add_count(n)
+    return run
+
+
+def run_tier(run):
+    # MERGE_FANIN times more transitions than the tier below
+    tier, size = 0, len(run[0]) // TRIGRAM_BUFFER
+    while size:
+        tier, size = tier + 1, size // MERGE_FANIN
+    return tier
+
+
+class MarkovBuilder:
+    def __init__(self):
+        self.ids = {}
+        self.vocab = []
+        self.unigrams = Counter()
+        # trigrams are buffered as packed ints, then kept as sorted runs of
+        # arrays, which take 16 bytes per transition
+        self.pending = []
+        self.runs = []
+        # the first and the last two words, to stitch shards together
+        self.head = []
+        self.tail = []
+
+    def intern(self, word):
+        word_id = self.ids.get(word)
+        if word_id is None:
+            word_id = self.ids[word] = len(self.vocab)
+            self.vocab.append(word)
+        return word_id
+
+    def add(self, keys):
+        self.pending.extend(keys)
+        if len(self.pending) >= TRIGRAM_BUFFER:
+            self.flush()
+
+    def flush(self):
+        self.push(trigram_run(Counter(self.pending)))
+        self.pending = []
+
+    def push(self, run):
+        # size tiered: MERGE_FANIN runs of one tier merge into a run of a
+        # higher tier, so a transition is merged a logarithmic number of
+        # times and big runs are never walked again for small ones
+        self.runs.append(run)
+        while len(self.runs) >= MERGE_FANIN and \
+                len(set(map(run_tier, self.runs[-MERGE_FANIN:]))) == 1:
+            merged = merge_runs(self.runs[-MERGE_FANIN:])
+            self.runs[-MERGE_FANIN:] = [merged]
+
+    def transitions(self):
+        # sorted states, successor ids and counts of every transition
+        if self.pending:
+            self.flush()
+        if len(self.runs) != 1:
+            self.runs = [merge_runs(self.runs)]
+        return self.runs[0]
+
+    def feed(self, lines):
+        for line in lines:
+            ids = [self.intern(w) for w in line.split(" ")]
+            self.unigrams.update(ids)
+            self.head.extend(ids[:2 - len(self.head)])
+            seq = self.tail + ids
+            self.add(map(pack, seq, seq[1:], seq[2:]))
+            self.tail = seq[-2:]
+        return self
+
+    def merge(self, other):
+        remap = [self.intern(w) for w in other.vocab]
+        head = [remap[i] for i in other.head]
+        seq = self.tail + head
+        self.add(map(pack, seq, seq[1:], seq[2:]))
+        states, successors, counts = other.transitions()
+        for start in range(0, len(counts), TRIGRAM_BUFFER):
+            end = start + TRIGRAM_BUFFER
+            self.push(trigram_run({
+                pack(remap[state >> WORD_BITS], remap[state & WORD_MASK],
+                     remap[successor]): n
+                for state, successor, n in zip(states[start:end],
+                                               successors[start:end],
+                                               counts[start:end])}))
+        for word_id, n in other.unigrams.items():
+            self.unigrams[remap[word_id]] += n
+        self.head = (self.head + head)[:2]
+        self.tail = (self.tail + [remap[i] for i in other.tail])[-2:]
+        return self
+
+    def states(self):
+        # successor ids and counts of every (w1, w2) state, ordered by id
+        res = {}
+        last = None
+        for state, successor, n in zip(*self.transitions()):
+            if state != last:
+                last = state
+                successors, counts = array("I"), array("I")
+                res[divmod(state, 1 << WORD_BITS)] = successors, counts
+            successors.append(successor)
+            counts.append(n)
+        return res
+
+
+def shard_bounds(view, shards):
+    bounds = [0]
+    for i in range(1, shards):
+        pos = view.find(b"\n", max(len(view) * i // shards, bounds[-1]))
+        bounds.append(len(view) if pos == -1 else pos + 1)
+    bounds.append(len(view))
+    return bounds
+
+
+def build_shard(filename, start, end, encoding):
+    lines = io.BytesIO(mapped(filename)[start:end])
+    return MarkovBuilder().feed(line.decode(encoding) for line in lines)
+
+
+def markov_builder(filename, processes=None, encoding="utf-8"):
+    processes = processes or os.cpu_count()
+    if codec_for(filename) is not None or processes == 1:
+        lines = read_lines(filename, encoding, processes=processes)
+        return MarkovBuilder().feed(lines)
+
+    view = mapped(filename)
+    bounds = shard_bounds(view, max(processes, len(view) // SHARD_SIZE + 1))
+    with ProcessPoolExecutor(processes) as pool:
+        parts = pool.map(build_shard, repeat(filename), bounds, bounds[1:],
+                         repeat(encoding))
+        return functools.reduce(MarkovBuilder.merge, parts, MarkovBuilder())
+
+
 def transition_matrix(words_list):
     res = {}
     for i in range(len(words_list) - 2):
@@ -94,11 +735,164 @@ def markov_chain(words_list, matrix, n):
     return " ".join(res)
 
 
+MODEL_HEADER = struct.Struct("<8sQQQQqQ")
+MODEL_MAGIC = b"MARKOV02"
+
+
+def save_model(builder, path, source=(0, 0, 0)):
+    # header with the size, mtime and inode of the source, then word
+    # offsets, cumulative word counts, sorted state keys, CSR state offsets,
+    # cumulative successor weights, successor ids and the utf-8 vocabulary
+    # blob
+    keys, offsets = array("Q"), array("Q")
+    weights, successors = array("Q"), array("I")
+    for state, successor, n in zip(*builder.transitions()):
+        if not keys or keys[-1] != state:
+            keys.append(state)
+            offsets.append(len(successors))
+            total = 0
+        total += n
+        weights.append(total)
+        successors.append(successor)
+    offsets.append(len(successors))
+    encoded = [w.encode() for w in builder.vocab]
+    word_offsets = array("Q", [0])
+    word_offsets.extend(accumulate(map(len, encoded)))
+    starts = array("Q", accumulate(builder.unigrams[i]
+                                   for i in range(len(encoded))))
+
+    with tempfile.NamedTemporaryFile("wb", dir=os.path.dirname(path) or ".",
+                                     delete=False) as handle:
+        handle.write(MODEL_HEADER.pack(MODEL_MAGIC, len(encoded), len(keys),
+                                       len(successors), *source))
+        for section in [word_offsets, starts, keys, offsets, weights,
+                        successors]:
+            section.tofile(handle)
+        handle.write(b"".join(encoded))
+    os.replace(handle.name, path)
+    return path
+
+
+class MarkovModel:
+    def __init__(self, view):
+        magic, n_words, n_states, n_transitions, *_ = \
+            MODEL_HEADER.unpack_from(view)
+        if magic != MODEL_MAGIC:
+            raise ValueError("Not a compiled Markov model")
+        self.data = memoryview(view)
+        self.pos = MODEL_HEADER.size
+        self.word_offsets = self.section("Q", n_words + 1)
+        self.starts = self.section("Q", n_words)
+        self.keys = self.section("Q", n_states)
+        self.offsets = self.section("Q", n_states + 1)
+        self.weights = self.section("Q", n_transitions)
+        self.successors = self.section("I", n_transitions)
+        self.blob = self.data[self.pos:]
+
+    def section(self, fmt, size):
+        end = self.pos + size * struct.calcsize(fmt)
+        res = self.data[self.pos:end].cast(fmt)
+        self.pos = end
+        return res
+
+    def word(self, word_id):
+        start, end = self.word_offsets[word_id], self.word_offsets[word_id + 1]
+        return str(self.blob[start:end], "utf-8")
+
+    def start(self, rng=random):
+        return bisect.bisect_right(self.starts, rng.randrange(self.starts[-1]))
+
+    def next(self, w1, w2, rng=random):
+        key = w1 << WORD_BITS | w2
+        state = bisect.bisect_left(self.keys, key)
+        if state == len(self.keys) or self.keys[state] != key:
+            return self.start(rng)
+        lo, hi = self.offsets[state], self.offsets[state + 1]
+        weight = rng.randrange(self.weights[hi - 1])
+        return self.successors[bisect.bisect_right(self.weights, weight,
+                                                   lo, hi)]
+
+    def generate(self, n, rng=random):
+        if n == 0:
+            return ""
+        res = [self.start(rng)]
+        if n > 1:
+            res.append(self.start(rng))
+        for _ in range(n - 2):
+            res.append(self.next(res[-2], res[-1], rng))
+        return " ".join(map(self.word, res))
+
+
+@functools.lru_cache(maxsize=8)
+def open_model(path, mtime_ns, size, inode):
+    return MarkovModel(mapped(path))
+
+
+def load_model(path):
+    stat = os.stat(path)
+    return open_model(path, stat.st_mtime_ns, stat.st_size, stat.st_ino)
+
+
+def source_key(filename):
+    stat = os.stat(filename)
+    return stat.st_size, stat.st_mtime_ns, stat.st_ino
+
+
+def model_source(path):
+    # the source key a compiled model was built from, None if unusable
+    try:
+        with open(path, "rb") as handle:
+            header = handle.read(MODEL_HEADER.size)
+    except FileNotFoundError:
+        return None
+    if len(header) < MODEL_HEADER.size:
+        return None
+    magic, _, _, _, *source = MODEL_HEADER.unpack(header)
+    return tuple(source) if magic == MODEL_MAGIC else None
+
+
+def cache_dir():
+    # per user and private, other users cannot plant or swap models
+    base = os.environ.get("XDG_CACHE_HOME") or \
+        os.path.join(os.path.expanduser("~"), ".cache")
+    path = os.path.join(base, "snoop")
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    return path
+
+
+def compiled_model(filename, path=None, processes=None):
+    if path is None:
+        name = hashlib.sha1(os.path.abspath(filename).encode()).hexdigest()
+        path = os.path.join(cache_dir(), name + ".markov")
+    source = source_key(filename)
+    if model_source(path) != source:
+        save_model(markov_builder(filename, processes), path, source)
+    return path
+
+
+def generate_texts(path, n, seeds):
+    model = load_model(path)
+    return [model.generate(n, random.Random(seed)) for seed in seeds]
+
+
 def snoop_says(filename, n):
-    file = open(filename, encoding="utf-8")
-    words_list = words(file)
-    matrix = transition_matrix(words_list)
-    return markov_chain(words_list, matrix, n)
+    return load_model(compiled_model(filename)).generate(n)
+
+
+def snoop_batch(filename, n, count, processes=1, seed=None):
+    path = compiled_model(filename)
+    rng = random.Random(seed)
+    seeds = [rng.getrandbits(64) for _ in range(count)]
+    processes = processes or os.cpu_count()
+    if processes == 1:
+        return generate_texts(path, n, seeds)
+
+    step = max(1, -(-count // (4 * processes)))
+    batches = [seeds[i:i + step] for i in range(0, count, step)]
+    with ProcessPoolExecutor(processes) as pool:
+        return [text for texts in pool.map(generate_texts, repeat(path),
+                                           repeat(n), batches)
+                for text in texts]
 
 
 # Asserts
@@ -111,9 +905,121 @@ assert cut_suffix("foobar", "bar") == "foo", assert_msg
 assert cut_suffix("foobar", "boo") == "foobar", assert_msg
 
 assert find_all("abracadabra", "a") == [0, 3, 5, 7, 10], assert_msg
+assert PatternMatcher(["a", "abra", "bra", "cad"]).find_all("abracadabra") == \
+    {"a": [0, 3, 5, 7, 10], "abra": [0, 7], "bra": [1, 8], "cad": [4]}, \
+    assert_msg
+assert list(PatternMatcher(["aa", "b"]).finditer([b"aa", b"ab", b"aa"])) == \
+    [(0, "aa"), (1, "aa"), (3, "b"), (4, "aa")], assert_msg
 
 assert common_prefix("abra", "abracadabra", "abrasive") == "abra", assert_msg
 assert common_prefix("abra", "foobar") == "", assert_msg
+assert common_prefix("abrasive", "abra") == "abra", assert_msg
+
+test_index = PrefixIndex(["usr/lib", "usr/bin", "usr/lib/python", "var/log"])
+assert test_index.common_prefix(["usr/lib/python", "usr/lib"]) == "usr/lib", \
+    assert_msg
+assert test_index.common_prefix(["usr/bin", "usr/lib/python"]) == "usr/", \
+    assert_msg
+assert test_index.groups(4) == {"usr/": ["usr/bin", "usr/lib",
+                                         "usr/lib/python"],
+                                "var/log": ["var/log"]}, assert_msg
+assert test_index.groups(8) == {"usr/lib/python": ["usr/lib/python"]}, \
+    assert_msg
 
 assert parse_shebang("./example1.txt") == "/bin/sh", assert_msg
 assert parse_shebang("./example2.txt") == "/usr/bin/env python -v", assert_msg
+
+with tempfile.TemporaryDirectory() as test_dir:
+    for suffix, compress in [(".gz", gzip.compress), (".bz2", bz2.compress),
+                             (".xz", lzma.compress), (".txt", bytes)]:
+        test_path = os.path.join(test_dir, "test" + suffix)
+        with open(test_path, "wb") as handle:
+            handle.write(compress(b"foo\nbar") + compress(b"\nbaz\n"))
+        assert list(read_lines(test_path, processes=1)) == \
+            ["foo\n", "bar\n", "baz\n"], assert_msg
+
+# members as written by bgzip, xz and pbzip2, plus a single gzip member
+# with the gzip signature in its payload
+test_data = [b"foo\n" * 100, b"\x1f\x8b\x08\x00bar\n", b""]
+test_bgzf = []
+for test_block in test_data:
+    test_deflate = zlib.compressobj(9, zlib.DEFLATED, -15)
+    test_body = test_deflate.compress(test_block) + test_deflate.flush()
+    test_bgzf.append(b"\x1f\x8b\x08\x04\0\0\0\0\0\xff\x06\0BC\x02\0" +
+                     (len(test_body) + 25).to_bytes(2, "little") + test_body +
+                     zlib.crc32(test_block).to_bytes(4, "little") +
+                     len(test_block).to_bytes(4, "little"))
+test_blobs = [(".gz", b"".join(test_bgzf)),
+              (".xz", b"".join(map(lzma.compress, test_data))),
+              (".gz", gzip.compress(b"".join(test_data))),
+              (".gz", b"".join(map(gzip.compress, test_data))),
+              (".bz2", b"".join(map(bz2.compress, test_data)))]
+assert len(bgzf_bounds(test_blobs[0][1])) == 3, assert_msg
+assert bgzf_bounds(test_blobs[2][1]) is None, assert_msg
+assert [unit.size for unit in xz_bounds(test_blobs[1][1])] == [400, 8], \
+    assert_msg
+assert len(list(member_starts(test_blobs[4][1], MEMBER_STARTS[".bz2"]))) == \
+    2, assert_msg
+
+with tempfile.TemporaryDirectory() as test_dir:
+    for test_i, (suffix, test_blob) in enumerate(test_blobs):
+        test_path = os.path.join(test_dir, f"members{test_i}{suffix}")
+        with open(test_path, "wb") as handle:
+            handle.write(test_blob)
+        assert b"".join(read_chunks(test_path, processes=1)) == \
+            b"".join(test_data), assert_msg
+        if suffix in MEMBER_BOUNDS and MEMBER_BOUNDS[suffix](test_blob):
+            assert b"".join(inflate_units(
+                test_path, suffix, MEMBER_BOUNDS[suffix](test_blob))) == \
+                b"".join(test_data), assert_msg
+    assert inflate_candidate(test_path, ".bz2", 0)[2] == test_data[0], \
+        assert_msg
+    assert inflate_candidate(test_path, ".bz2", 1)[1] is None, assert_msg
+
+
+test_lines = ["a b a\n", "b c a b\n", "a b a\n"]
+test_matrix = transition_matrix(words(test_lines))
+test_builder = functools.reduce(MarkovBuilder.merge,
+                                [MarkovBuilder().feed([line])
+                                 for line in test_lines], MarkovBuilder())
+assert {(test_builder.vocab[w1], test_builder.vocab[w2]):
+        Counter({test_builder.vocab[w]: n for w, n in zip(*successors)})
+        for (w1, w2), successors in test_builder.states().items()} == \
+    {key: Counter(value) for key, value in test_matrix.items()}, assert_msg
+
+with tempfile.TemporaryDirectory() as test_dir:
+    test_model = load_model(save_model(test_builder,
+                                       os.path.join(test_dir, "test.markov")))
+    assert [test_model.word(i) for i in range(len(test_builder.vocab))] == \
+        test_builder.vocab, assert_msg
+    assert len(test_model.generate(10).split(" ")) == 10, assert_msg
+    assert all(test_model.word(test_model.next(test_builder.ids["c"],
+                                               test_builder.ids["a"])) == "b\n"
+               for _ in range(10)), assert_msg
+    del test_model
+    open_model.cache_clear()
+
+    test_source = os.path.join(test_dir, "corpus.txt")
+    test_path = os.path.join(test_dir, "corpus.markov")
+    for test_text in ["a b a\n", "a b cd\n"]:
+        with open(test_source, "w") as handle:
+            handle.write(test_text)
+        os.utime(test_source, ns=(0, 0))
+        assert compiled_model(test_source, test_path, processes=1) == \
+            test_path, assert_msg
+        assert model_source(test_path) == source_key(test_source), assert_msg
+        assert load_model(test_path).word(2) == test_text[4:], assert_msg
+    assert sorted(os.listdir(test_dir)) == ["corpus.markov", "corpus.txt",
+                                            "test.markov"], assert_msg
+    open_model.cache_clear()
+
+if __name__ == "__main__":
+    # worker processes import this module, so pools only start once it has
+    # finished importing
+    with tempfile.TemporaryDirectory() as test_dir:
+        for test_i, (suffix, test_blob) in enumerate(test_blobs):
+            test_path = os.path.join(test_dir, f"members{test_i}{suffix}")
+            with open(test_path, "wb") as handle:
+                handle.write(test_blob)
+            assert b"".join(read_chunks(test_path, processes=2)) == \
+                b"".join(test_data), assert_msg